@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import argparse, csv, os, re, sys, unicodedata
+import argparse, csv, functools, os, re, sys, unicodedata
 from pathlib import Path
 from collections import defaultdict
 import pandas as pd
@@ -15,39 +15,56 @@ MESSAGE_TYPE = (
 )
 
 # ---------- Normalisation ----------
+# Motifs compilés une fois : ces fonctions tournent une fois par token et
+# par PDF, recompiler (même depuis le cache re) à chaque appel se paie.
+_RE_DIV = re.compile(r"([3-6])\D*([A-Z])")
+_RE_DIV_GAP = re.compile(r"(?<=\d)\s+(?=[A-Z])")
+_RE_NONALPHA = re.compile(r"[^a-z]")
+_RE_SPLIT = re.compile(r"[\s\-]+")
+
+# Mémoïsation : les mêmes tokens (classes, disciplines, prénoms fréquents)
+# reviennent des centaines de fois pendant l'indexation des PDFs — la
+# normalisation Unicode/regex ne se paie qu'une fois par valeur distincte.
+@functools.lru_cache(maxsize=None)
 def strip_accents(s: str) -> str:
     if s is None: return ""
-    return "".join(c for c in unicodedata.normalize("NFKD", str(s)) if not unicodedata.combining(c))
+    s = str(s)
+    # Fast path : une chaîne ASCII n'a aucun diacritique à décomposer
+    if s.isascii(): return s
+    return "".join(c for c in unicodedata.normalize("NFKD", s) if not unicodedata.combining(c))
 
+@functools.lru_cache(maxsize=None)
 def norm_div(s: str) -> str:
     if not s: return ""
     s = strip_accents(s).upper().replace("\u00A0"," ").strip()
-    m = re.search(r"([3-6])\D*([A-Z])", s)
+    m = _RE_DIV.search(s)
     if m: return f"{m.group(1)}{m.group(2)}"
-    return re.sub(r"(?<=\d)\s+(?=[A-Z])", "", s)
+    return _RE_DIV_GAP.sub("", s)
 
+@functools.lru_cache(maxsize=None)
 def norm_name_token(s: str) -> str:
-    s = strip_accents(str(s)).lower().strip()
-    s = re.sub(r"['’`^¨~]", "", s)
-    s = re.sub(r"[^a-z]", "", s)
-    return s
+    # Un seul sub : [^a-z] couvre aussi les apostrophes/diacritiques isolés
+    # que l'ancienne première passe supprimait.
+    return _RE_NONALPHA.sub("", strip_accents(str(s)).lower())
 
 def split_name_field_to_tokens(piece: str):
     # Sépare espaces/traits d’union en tokens
     piece = strip_accents(piece).strip()
-    subs = [t for t in re.split(r"[\s\-]+", piece) if t]
+    subs = [t for t in _RE_SPLIT.split(piece) if t]
     return subs
 
 def surname_key_from_tokens(tokens):
-    toks = [t for t in (norm_name_token(x) for x in tokens) if t]
-    return "".join(sorted(toks))
+    # Une seule passe map/filter/sorted, sans liste intermédiaire
+    return "".join(sorted(filter(None, map(norm_name_token, tokens))))
 
+@functools.lru_cache(maxsize=None)
 def surname_key_from_csv_nom(nom: str) -> str:
     raw = strip_accents(nom).strip()
-    tokens = re.split(r"[\s\-]+", raw)
+    tokens = _RE_SPLIT.split(raw)
     tokens = [t for t in tokens if t]
     return surname_key_from_tokens(tokens)
 
+@functools.lru_cache(maxsize=None)
 def norm_disc(s: str) -> str:
     s = strip_accents(s).lower().strip()
     if s.startswith("franc"): return "francais"
@@ -55,7 +72,23 @@ def norm_disc(s: str) -> str:
     return s
 
 # ---------- Index des PDF ----------
-def build_catalog(pdf_base: Path):
+def iter_pdfs(root):
+    """Parcours récursif via os.scandir : le type (fichier/dossier) est lu
+    depuis le DirEntry sans stat supplémentaire, contrairement à rglob."""
+    stack = [str(root)]
+    while stack:
+        d = stack.pop()
+        try:
+            with os.scandir(d) as it:
+                for e in it:
+                    if e.is_dir(follow_symlinks=False):
+                        stack.append(e.path)
+                    elif e.name.endswith(".pdf"):
+                        yield e
+        except OSError:
+            continue
+
+def build_catalog(pdf_base: Path, annee_filter=None):
     """
     Indexe récursivement tous les PDFs sous pdf_base.
 
@@ -65,52 +98,128 @@ def build_catalog(pdf_base: Path):
          puis on essaie comme 'prénom' TOUT segment contigu (longueur 1..n),
          en concaténant sans séparateur (ex: Lily + Morgane -> 'lilymorgane').
          Le reste des tokens = set des 'noms' (ordre indifférent).
+
+    Le main ne requête que deux disciplines ("francais"/"mathematiques")
+    pour une seule année : on spécialise donc l'index en deux dicts par
+    discipline (clés (divN, prénom, nom) plus courtes → hash et mémoire
+    réduits) et on filtre l'année dès l'insertion. Les index *_tok sont
+    les équivalents keyés par token de nom isolé, pour le fallback des
+    noms composés.
+
+    Au-delà de _PARALLEL_THRESHOLD fichiers, le parsing (pur CPU : regex +
+    double boucle sur les tokens) est réparti par lots sur les cœurs via
+    ProcessPoolExecutor ; en dessous, la boucle séquentielle évite le coût
+    de démarrage du pool. Le pool est désactivé dans le binaire PyInstaller
+    (sys.frozen) : les workers spawn doivent ré-importer ce module, ce qui
+    relancerait le pipeline gelé lui-même au lieu d'un interpréteur neutre —
+    le cas onefile retombe donc sur la boucle séquentielle.
     """
-    catalog = {}
+    entries = [(e.name, e.path) for e in iter_pdfs(pdf_base)]
+    cat_fr, cat_ma = {}, {}
+    tok_fr, tok_ma = {}, {}
     by_div = defaultdict(list)
 
-    for p in pdf_base.rglob("*.pdf"):
-        stem = p.stem
-        parts = stem.split("_")
-        if len(parts) < 4:
-            continue
-
-        div_raw = parts[0]
-        annee = parts[-1].strip()
-        disc_raw = parts[-2]
-        mid_blocks = parts[1:-2]  #
-
-        divN = norm_div(div_raw)
-        discN = norm_disc(disc_raw)
-
-        # Aplatir les blocs en sous-tokens
-        flat = []
-        for blk in mid_blocks:
-            flat.extend(split_name_field_to_tokens(blk))
-
-        if not flat:
-            flat = mid_blocks[:]
-
-        # Générer tous les segments contigus comme "prénom candidat"
-        n = len(flat)
-        for i in range(n):
-            for j in range(i, n):
-                pren_concat = "".join(norm_name_token(t) for t in flat[i:j+1])
-                if not pren_concat:
-                    continue
-                # Les autres tokens (hors i..j) deviennent les 'noms'
-                sur_tokens = [flat[k] for k in range(n) if k < i or k > j]
-                sur_key = surname_key_from_tokens(sur_tokens)
-                key = (divN, pren_concat, sur_key, discN, annee)
-                catalog[key] = str(p)
-
-        by_div[divN].append(p.name)
-
-    return catalog, by_div
+    if (len(entries) >= _PARALLEL_THRESHOLD and (os.cpu_count() or 1) > 1
+            and not getattr(sys, "frozen", False)):
+        from concurrent.futures import ProcessPoolExecutor
+        chunks = [entries[k:k + 256] for k in range(0, len(entries), 256)]
+        worker = functools.partial(_parse_chunk, annee_filter=annee_filter)
+        with ProcessPoolExecutor() as ex:
+            for r_fr, r_ma, r_tfr, r_tma, r_div in ex.map(worker, chunks):
+                cat_fr.update(r_fr); cat_ma.update(r_ma)
+                tok_fr.update(r_tfr); tok_ma.update(r_tma)
+                for divN, names in r_div.items():
+                    by_div[divN].extend(names)
+    else:
+        for name, path in entries:
+            _index_one(name, path, annee_filter, cat_fr, cat_ma, tok_fr, tok_ma, by_div)
+
+    return cat_fr, cat_ma, tok_fr, tok_ma, by_div
+
+# Seuil en dessous duquel le pool de processus ne vaut pas son démarrage
+_PARALLEL_THRESHOLD = 2000
+
+def _parse_chunk(items, annee_filter=None):
+    """Worker de pool : indexe un lot de (nom, chemin) et renvoie ses dicts."""
+    cat_fr, cat_ma = {}, {}
+    tok_fr, tok_ma = {}, {}
+    by_div = defaultdict(list)
+    for name, path in items:
+        _index_one(name, path, annee_filter, cat_fr, cat_ma, tok_fr, tok_ma, by_div)
+    return cat_fr, cat_ma, tok_fr, tok_ma, dict(by_div)
+
+def _index_one(name, path, annee_filter, cat_fr, cat_ma, tok_fr, tok_ma, by_div):
+    """Indexe un PDF (déjà localisé) dans les dicts passés en argument."""
+    # iter_pdfs garantit le suffixe .pdf : la tranche remplace Path(name).stem
+    stem = name[:-4]
+    parts = stem.split("_")
+    if len(parts) < 4:
+        return
+
+    div_raw = parts[0]
+    annee = parts[-1].strip()
+    if annee_filter and annee != annee_filter:
+        return
+    disc_raw = parts[-2]
+    mid_blocks = parts[1:-2]  #
+
+    divN = norm_div(div_raw)
+    discN = norm_disc(disc_raw)
+    if discN == "francais":
+        cat, tok = cat_fr, tok_fr
+    elif discN == "mathematiques":
+        cat, tok = cat_ma, tok_ma
+    else:
+        return
+
+    # Aplatir les blocs en sous-tokens
+    flat = []
+    for blk in mid_blocks:
+        flat.extend(split_name_field_to_tokens(blk))
+
+    if not flat:
+        flat = mid_blocks[:]
+
+    # Chaque token n'est normalisé qu'une fois par PDF : la double boucle
+    # réutilise flat_norm au lieu de rappeler norm_name_token par segment.
+    flat_norm = [norm_name_token(t) for t in flat]
+
+    # Concaténations par préfixes : le candidat 'prénom' d'un segment
+    # [i..j] est une tranche de prefix, plus de join par paire (i,j).
+    n = len(flat)
+    prefix = [""] * (n + 1)
+    for k in range(n):
+        prefix[k + 1] = prefix[k] + flat_norm[k]
+
+    # Générer tous les segments contigus comme "prénom candidat"
+    for i in range(n):
+        start = len(prefix[i])
+        for j in range(i, n):
+            pren_concat = prefix[j + 1][start:]
+            if not pren_concat:
+                continue
+            # Les autres tokens (hors i..j) deviennent les 'noms'
+            comp = flat_norm[:i] + flat_norm[j + 1:]
+            sur_key = "".join(sorted(filter(None, comp)))
+            cat[(divN, pren_concat, sur_key)] = path
+            for t in comp:
+                if t:
+                    tok[(divN, pren_concat, t)] = path
+
+    by_div[divN].append(name)
 
 # ---------- Lecture CSV ----------
+def _detect_sep(path: str) -> str:
+    # merge_parents_4e écrit ses CSV en ';' (convention Excel FR) alors que
+    # d'autres sources sortent en ',' : compter les deux sur un préfixe
+    # suffit à trancher, et garde le parseur C de pandas (sep=None
+    # basculerait sur le moteur python).
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        s = f.read(4096)
+    return ";" if s.count(";") >= s.count(",") else ","
+
 def read_input_csv(path: str) -> pd.DataFrame:
-    df = pd.read_csv(path, dtype=str).fillna("")
+    df = pd.read_csv(path, dtype=str, sep=_detect_sep(path)).fillna("")
     ren = {}
     if "Nom de famille" in df.columns: ren["Nom de famille"] = "Nom"
     if "Prénom 1" in df.columns: ren["Prénom 1"] = "Prenom"
@@ -118,18 +227,20 @@ def read_input_csv(path: str) -> pd.DataFrame:
     df = df.rename(columns=ren)
     if "Division" not in df.columns:
         raise ValueError("Colonne 'Division' absente.")
-    df["Division"] = df["Division"].apply(norm_div)
+    # Peu de valeurs distinctes (une poignée de divisions par export) :
+    # normaliser les uniques puis diffuser par map, plutôt qu'un appel par ligne
+    df["Division"] = df["Division"].map({v: norm_div(v) for v in df["Division"].unique()})
     return df
 
 # ---------- Main ----------
-def main():
+def main(argv=None):
     ap = argparse.ArgumentParser()
     ap.add_argument("--in", dest="inp", required=True, help="parents_4e_merged.csv")
     ap.add_argument("--pdf-base", dest="pdf_base", required=True, help="Dossier racine des PDFs (récursif)")
     ap.add_argument("--out", dest="out_csv", required=True, help="CSV de sortie pour Thunderbird")
     ap.add_argument("--annee", dest="annee", default="2025-2026")
     ap.add_argument("--missing", dest="missing_csv", default=None, help="CSV des cas sans PJ")
-    args = ap.parse_args()
+    args = ap.parse_args(argv)
 
     base = Path(args.pdf_base)
     if not base.exists():
@@ -137,49 +248,81 @@ def main():
         sys.exit(1)
 
     print("[INFO] Indexation des PDFs…")
-    catalog, by_div = build_catalog(base)
+    cat_fr, cat_ma, tok_fr, tok_ma, by_div = build_catalog(base, args.annee)
 
     print("[INFO] Lecture du CSV…")
     df = read_input_csv(args.inp)
 
-    rows_out, rows_missing = [], []
     count_fr = count_ma = total = 0
 
-    for _, r in df.iterrows():
-        nom_raw = (r.get("Nom","") or "").strip()
-        prenom_raw = (r.get("Prenom","") or "").strip()
-        div_raw = (r.get("Division","") or "").strip()
+    # Écriture en flux : chaque ligne part directement dans son CSV, sans
+    # accumuler rows_out/rows_missing en mémoire. Le fichier des manquants
+    # n'est ouvert qu'au premier manquant (sinon il ne contient que le
+    # marqueur "Tout trouvé :)" écrit après la boucle).
+    out_fields = ["Classe","Nom","Prénom","Emails","PJ_francais","PJ_math","Attachments","Annee","Objet","CorpsMessage"]
+    miss_fields = ["Division","Nom","Prénom","Attendu_Fr_1","Attendu_Fr_2",
+                   "Attendu_Ma_1","Attendu_Ma_2","ExemplesFichiersDansDivision"]
+    miss_path = args.missing_csv or str(Path(args.out_csv).with_name("missing_4e.csv"))
+    f_out = open(args.out_csv, "w", newline="", encoding="utf-8")
+    w_out = csv.writer(f_out)
+    w_out.writerow(out_fields)
+    f_miss, w_miss = None, None
+
+    # Itération par zip sur les colonnes sous-jacentes : contrairement à
+    # iterrows(), aucune Series n'est construite par ligne.
+    def _col(name):
+        return df[name] if name in df.columns else [""] * len(df)
+
+    # Normalisation par colonne, une fois pour toutes avant la boucle :
+    # chaque valeur unique (division, prénom, nom) n'est normalisée qu'une
+    # seule fois via Series.map au lieu d'un appel Python par ligne.
+    def _norm_col(series, fn):
+        s = series if isinstance(series, pd.Series) else pd.Series(series, dtype=str)
+        return s.map({v: fn((v or "").strip()) for v in s.unique()})
+
+    nom_col, pren_col, div_col = _col("Nom"), _col("Prenom"), _col("Division")
+    divN_col = _norm_col(div_col, norm_div)
+    prenN_col = _norm_col(pren_col, norm_name_token)  # ex: "Lily-Morgane" -> "lilymorgane"
+    surk_col = _norm_col(nom_col, surname_key_from_csv_nom)
+
+    # Invariants de boucle en locales : l'année est constante, et lier les
+    # .get / normalisateurs évite un lookup global ou d'attribut par ligne.
+    annee = sys.intern(args.annee)
+    _catfr_get, _catma_get = cat_fr.get, cat_ma.get
+    _tokfr_get, _tokma_get = tok_fr.get, tok_ma.get
+    _nnt, _strip = norm_name_token, strip_accents
+
+    for nom_raw, prenom_raw, div_raw, divN, prenN, sur_key, email1, email2 in zip(
+        nom_col, pren_col, div_col, divN_col, prenN_col, surk_col,
+        _col("Courriel repr. légal"), _col("Courriel autre repr. légal"),
+    ):
+        nom_raw = (nom_raw or "").strip()
+        prenom_raw = (prenom_raw or "").strip()
+        div_raw = (div_raw or "").strip()
         if not (nom_raw and prenom_raw and div_raw):
             continue
 
-        divN = norm_div(div_raw)
-        prenN = norm_name_token(prenom_raw)  # ex: "Lily-Morgane" -> "lilymorgane"
-        sur_key = surname_key_from_csv_nom(nom_raw)
-        annee = args.annee
-
-        key_fr = (divN, prenN, sur_key, "francais", annee)
-        key_ma = (divN, prenN, sur_key, "mathematiques", annee)
+        key = (divN, prenN, sur_key)
+        pj_fr = _catfr_get(key, "")
+        pj_ma = _catma_get(key, "")
 
-        pj_fr = catalog.get(key_fr, "")
-        pj_ma = catalog.get(key_ma, "")
-
-        # Fallback: essayer chaque morceau isolé du nom composé comme clé "nom"
+        # Fallback: essayer chaque morceau isolé du nom composé comme clé "nom",
+        # via l'index par token construit pendant l'indexation
         if not pj_fr or not pj_ma:
-            tokens = [t for t in re.split(r"[\s\-]+", strip_accents(nom_raw).strip()) if t]
-            tokens_norm = [norm_name_token(t) for t in tokens]
-            alt_sur_keys = {"".join(sorted([t])) for t in tokens_norm if t}
+            tokens_norm = [t for t in (_nnt(x) for x in
+                                       _RE_SPLIT.split(_strip(nom_raw).strip())) if t]
             if not pj_fr:
-                for ak in alt_sur_keys:
-                    pj_fr = catalog.get((divN, prenN, ak, "francais", annee), pj_fr)
+                for t in tokens_norm:
+                    pj_fr = _tokfr_get((divN, prenN, t), "")
                     if pj_fr: break
             if not pj_ma:
-                for ak in alt_sur_keys:
-                    pj_ma = catalog.get((divN, prenN, ak, "mathematiques", annee), pj_ma)
+                for t in tokens_norm:
+                    pj_ma = _tokma_get((divN, prenN, t), "")
                     if pj_ma: break
 
         emails = ";".join([
-            (r.get("Courriel repr. légal","") or "").strip(),
-            (r.get("Courriel autre repr. légal","") or "").strip()
+            (email1 or "").strip(),
+            (email2 or "").strip()
         ])
         emails = ";".join([e for e in emails.split(";") if e])
 
@@ -190,22 +333,14 @@ def main():
         objet = f"Évaluations nationales – {nom_raw.upper()} {prenom_raw} ({divN})"
         attachments = ";".join([p for p in [pj_fr, pj_ma] if p])
 
-        rows_out.append({
-            "Classe": divN,
-            "Nom": nom_raw.upper(),
-            "Prénom": prenom_raw,
-            "Emails": emails,
-            "PJ_francais": pj_fr,
-            "PJ_math": pj_ma,
-            "Attachments": attachments,
-            "Annee": annee,
-            "Objet": objet,
-            "CorpsMessage": MESSAGE_TYPE
-        })
+        # Tuple dans l'ordre de out_fields : écrit tel quel par csv.writer,
+        # sans les ~10 recherches de clés par ligne du DictWriter.
+        w_out.writerow((divN, nom_raw.upper(), prenom_raw, emails, pj_fr, pj_ma,
+                        attachments, annee, objet, MESSAGE_TYPE))
 
         if not pj_fr and not pj_ma:
             present = ", ".join(by_div.get(divN, [])[:12])
-            nom_tokens = [t for t in re.split(r"[\s\-]+", nom_raw.strip()) if t]
+            nom_tokens = [t for t in _RE_SPLIT.split(nom_raw.strip()) if t]
             if len(nom_tokens) >= 2:
                 nom1, nom2 = nom_tokens[0].upper(), nom_tokens[-1].upper()
             else:
@@ -216,31 +351,19 @@ def main():
             attendu_ma_a = f"{divN}_{nom_raw.upper()}_{prenom_raw}_Mathématiques_{annee}.pdf"
             attendu_ma_b = f"{divN}_{nom1}_{prenom_raw}_{nom2}_Mathématiques_{annee}.pdf" if nom2 else ""
 
-            rows_missing.append({
-                "Division": divN,
-                "Nom": nom_raw,
-                "Prénom": prenom_raw,
-                "Attendu_Fr_1": attendu_fr_a,
-                "Attendu_Fr_2": attendu_fr_b,
-                "Attendu_Ma_1": attendu_ma_a,
-                "Attendu_Ma_2": attendu_ma_b,
-                "ExemplesFichiersDansDivision": present
-            })
-
-    out_fields = ["Classe","Nom","Prénom","Emails","PJ_francais","PJ_math","Attachments","Annee","Objet","CorpsMessage"]
-    with open(args.out_csv, "w", newline="", encoding="utf-8") as f:
-        w = csv.DictWriter(f, fieldnames=out_fields)
-        w.writeheader()
-        w.writerows(rows_out)
-
-    miss_path = args.missing_csv or str(Path(args.out_csv).with_name("missing_4e.csv"))
-    with open(miss_path, "w", newline="", encoding="utf-8") as f:
-        if rows_missing:
-            w = csv.DictWriter(f, fieldnames=list(rows_missing[0].keys()))
-            w.writeheader()
-            w.writerows(rows_missing)
-        else:
-            w = csv.writer(f); w.writerow(["Tout trouvé :)"])
+            if w_miss is None:
+                f_miss = open(miss_path, "w", newline="", encoding="utf-8")
+                w_miss = csv.writer(f_miss)
+                w_miss.writerow(miss_fields)
+            w_miss.writerow((divN, nom_raw, prenom_raw, attendu_fr_a, attendu_fr_b,
+                             attendu_ma_a, attendu_ma_b, present))
+
+    f_out.close()
+    if f_miss is not None:
+        f_miss.close()
+    else:
+        with open(miss_path, "w", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerow(["Tout trouvé :)"])
 
     print(f"[OK] Élèves traités : {total}")
     print(f"     PJ Français trouvées : {count_fr}")
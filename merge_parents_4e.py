@@ -36,6 +36,8 @@ def err(msg: str):  print(f"[ERREUR] {msg}", file=sys.stderr)
 # Normalisation d'en-têtes
 # ============================
 def strip_accents(s: str) -> str:
+    # Fast path : une chaîne ASCII n'a aucun diacritique à décomposer
+    if s.isascii(): return s
     return ''.join(c for c in unicodedata.normalize('NFD', s) if unicodedata.category(c) != 'Mn')
 
 def canon_header(h: str) -> str:
@@ -44,6 +46,20 @@ def canon_header(h: str) -> str:
     h = re.sub(r'\s+', ' ', h)
     return h.lower()
 
+_RE_EQQUOTED = re.compile(r'^=\s*"(.+)"\s*$')   # enrobage Excel ="4 D"
+_RE_DIV_SEP = re.compile(r"[\s\-.]+")
+
+def norm_div_key(s: str) -> str:
+    """Canonise une division pour une clé de comparaison : "4 D"/="4 D"/4ème D → 4D."""
+    s = str(s or "").strip()
+    m = _RE_EQQUOTED.match(s)
+    if m:
+        s = m.group(1)
+    # Séparateurs d'abord, ordinal ensuite : "4ème D" → "4EMED" → "4D",
+    # la même clé que "4 D" (l'ordre inverse donnerait "4ED").
+    s = _RE_DIV_SEP.sub("", strip_accents(s).upper())
+    return s.replace("EME", "", 1)
+
 # Colonnes cibles minimales
 TARGET_COLS = [
     "Nom de famille",
@@ -79,6 +95,20 @@ def find_col(df_cols: List[str], targets: List[str]) -> Optional[str]:
             return norm[canon_header(t)]
     return None
 
+# Cibles déjà canonisées, calculées une fois à l'import : canon_header ne
+# repasse jamais sur les mêmes synonymes d'entêtes.
+_CANON_TARGETS = {k: [canon_header(t) for t in ts] for k, ts in HEADER_MAP.items()}
+
+def resolve_headers(df_cols) -> dict:
+    """Résout toutes les colonnes utiles en une seule passe sur les entêtes.
+
+    Équivalent à cinq appels find_col, mais l'index {canon: original} n'est
+    construit qu'une fois : O(colonnes + cibles) au lieu de O(colonnes × cibles).
+    """
+    norm_idx = {canon_header(c): c for c in df_cols}
+    return {k: next((norm_idx[t] for t in targets if t in norm_idx), None)
+            for k, targets in _CANON_TARGETS.items()}
+
 # ============================
 # Lecture robuste du CSV SIECLE
 # ============================
@@ -96,8 +126,10 @@ def read_siecle_csv(path: str) -> Tuple[pd.DataFrame, str, str]:
                 df = pd.read_csv(path, sep=sep, encoding=enc, dtype=str, engine="python")
                 # drop colonnes vides exactes
                 df = df.dropna(how="all", axis=1)
-                # trim
-                df = df.applymap(lambda x: x.strip() if isinstance(x, str) else x)
+                # trim vectorisé : .str.strip() par colonne (code C), au lieu
+                # d'un rappel Python par cellule via applymap ; les NaN passent
+                # au travers comme avant.
+                df = df.apply(lambda s: s.str.strip())
                 headers = list(df.columns)
                 print(f"Entêtes CSV détectées ({enc}, sep='{sep}') : {headers}")
                 return df, enc, sep
@@ -109,6 +141,87 @@ def read_siecle_csv(path: str) -> Tuple[pd.DataFrame, str, str]:
 # ============================
 # Pipeline de fusion
 # ============================
+def combine_email_series(e1: pd.Series, e2: pd.Series) -> pd.Series:
+    """Combine deux colonnes d'adresses en une Series 'Emails' (';', dédoublonné).
+
+    Normalisation des séparateurs et concaténation vectorisées (.str) ; seule
+    la dé-duplication insensible à la casse reste en Python, sur des listes
+    déjà découpées.
+    """
+    e1 = e1.fillna("").astype(str).str.replace(",", ";", regex=False)
+    e2 = e2.fillna("").astype(str).str.replace(",", ";", regex=False)
+    both = (e1 + ";" + e2).str.split(";")
+
+    def _dedup(parts):
+        out, seen = [], set()
+        for e in parts:
+            e = e.strip()
+            if e:
+                le = e.lower()
+                if le not in seen:
+                    seen.add(le)
+                    out.append(e)
+        return ";".join(out)
+
+    return both.map(_dedup)
+
+def _resolve_canonical(df: pd.DataFrame, path: str) -> pd.DataFrame:
+    """Renomme les colonnes d'un export SIECLE vers les intitulés canoniques."""
+    cols = resolve_headers(df.columns)
+    col_div, col_nom, col_pre = cols["division"], cols["nom"], cols["prenom"]
+    col_e1, col_e2 = cols["email1"], cols["email2"]
+    if not col_div or not col_nom or not col_pre:
+        raise KeyError(f"Colonnes essentielles manquantes dans {path}. "
+                       f"Résolu: Division='{col_div}' | Nom='{col_nom}' | Prénom='{col_pre}'")
+    ren = {col_nom: "Nom de famille", col_pre: "Prénom 1", col_div: "Division"}
+    if col_e1: ren[col_e1] = "Courriel repr. légal"
+    if col_e2: ren[col_e2] = "Courriel autre repr. légal"
+    return df[list(ren)].rename(columns=ren)
+
+def merge_files(parents_csvs: List[str], out_dir: str = ".") -> str:
+    """
+    Fusionne un ou plusieurs exports SIECLE en 'parents_4e_merged.csv'.
+
+    Point d'entrée utilisé par pipeline_evalnat. Les exports sont concaténés
+    puis dédupliqués par élève (Nom/Prénom/Division) : la réduction 'première
+    valeur non vide par colonne' passe par groupby(...).first(), une passe
+    C vectorisée, pas un rappel Python par groupe.
+    """
+    frames = []
+    for path in parents_csvs:
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"Fichier parents introuvable: {path}")
+        df, used_enc, used_sep = read_siecle_csv(path)
+        info(f"Lecture CSV: {os.path.basename(path)} (encodage={used_enc}, sep='{used_sep}')")
+        if df.empty:
+            warn(f"CSV vide ignoré: {path}")
+            continue
+        frames.append(_resolve_canonical(df, path))
+    if not frames:
+        raise ValueError("Aucun export SIECLE exploitable.")
+
+    merged = pd.concat(frames, ignore_index=True)
+    # La composante Division de la clé est canonisée : le même élève exporté
+    # en "4 D", ="4 D" ou "4ème D" selon les fichiers ne doit donner qu'une
+    # ligne. Peu de divisions distinctes → normaliser les uniques puis map.
+    div_raw = merged["Division"].fillna("").astype(str)
+    merged["_div_key"] = div_raw.map({v: norm_div_key(v) for v in div_raw.unique()})
+    key_cols = ["Nom de famille", "Prénom 1", "_div_key"]
+    merged = merged.replace("", pd.NA)
+    merged = merged.groupby(key_cols, dropna=False, as_index=False, sort=False).first()
+    merged = merged.fillna("").drop(columns=["_div_key"])
+
+    empty = pd.Series([""] * len(merged), index=merged.index)
+    e1 = merged.get("Courriel repr. légal", empty)
+    e2 = merged.get("Courriel autre repr. légal", empty)
+    merged["Emails"] = combine_email_series(e1, e2)
+
+    os.makedirs(out_dir, exist_ok=True)
+    merged_path = os.path.join(out_dir, "parents_4e_merged.csv")
+    merged.to_csv(merged_path, sep=";", index=False, encoding="utf-8")
+    ok(f"-> fusion écrite : {merged_path} ({len(merged)} lignes)")
+    return merged_path
+
 def fuse_single(parents_csv: str, classe: Optional[str], out_dir: str) -> Tuple[str, Optional[str]]:
     if not os.path.isfile(parents_csv):
         raise FileNotFoundError(f"Fichier parents introuvable: {parents_csv}")
@@ -125,12 +238,10 @@ def fuse_single(parents_csv: str, classe: Optional[str], out_dir: str) -> Tuple[
     if df.empty:
         raise ValueError("CSV vide.")
 
-    # Résolution tolérante des colonnes nécessaires
-    col_div = find_col(df.columns, HEADER_MAP["division"])
-    col_nom = find_col(df.columns, HEADER_MAP["nom"])
-    col_pre = find_col(df.columns, HEADER_MAP["prenom"])
-    col_e1  = find_col(df.columns, HEADER_MAP["email1"])
-    col_e2  = find_col(df.columns, HEADER_MAP["email2"])
+    # Résolution tolérante des colonnes nécessaires (une passe sur les entêtes)
+    cols = resolve_headers(df.columns)
+    col_div, col_nom, col_pre = cols["division"], cols["nom"], cols["prenom"]
+    col_e1, col_e2 = cols["email1"], cols["email2"]
 
     # Log debug lisible
     print(f"Colonnes détectées → Division='{col_div}' | Nom='{col_nom}' | Prénom='{col_pre}'")
@@ -141,28 +252,12 @@ def fuse_single(parents_csv: str, classe: Optional[str], out_dir: str) -> Tuple[
         print(sample)
         raise KeyError(f"Colonnes essentielles manquantes. Résolu: Division='{col_div}' | Nom='{col_nom}' | Prénom='{col_pre}'")
 
-    # Construire Emails combinés
-    def join_emails(a: Optional[str], b: Optional[str]) -> str:
-        parts = []
-        for x in [a, b]:
-            if isinstance(x, str) and x.strip():
-                # Normaliser séparateurs , -> ;
-                parts.extend([p.strip() for p in x.replace(",", ";").split(";") if p.strip()])
-        # dédoublonner
-        out, seen = [], set()
-        for e in parts:
-            le = e.lower()
-            if le not in seen:
-                seen.add(le)
-                out.append(e)
-        return ";".join(out)
-
-    emails = []
-    for _, row in df.iterrows():
-        a = row.get(col_e1, "")
-        b = row.get(col_e2, "")
-        emails.append(join_emails(a, b))
-    df["Emails"] = emails
+    # Construire Emails combinés (vectorisé, plus d'iterrows)
+    empty = pd.Series([""] * len(df), index=df.index)
+    df["Emails"] = combine_email_series(
+        df[col_e1] if col_e1 else empty,
+        df[col_e2] if col_e2 else empty,
+    )
     non_empty = (df["Emails"].astype(str).str.strip() != "").sum()
     print(f"[INFO] Emails non vides : {non_empty}/{len(df)}")
 
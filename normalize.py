@@ -5,17 +5,25 @@ import csv, re, unicodedata
 src = Path("/Users/julien/Downloads/Scripts qui semblent OK/parents_4e_merged.csv")
 dst = src.with_name("parents_4e_merged_norm.csv")
 
+# Motifs compilés une fois pour tout le fichier
+RE_EXCEL = re.compile(r'^=\s*"(.+)"\s*$')
+RE_SEP = re.compile(r"[\s\-.]+")
+
 def normalize_div(s: str) -> str:
     s = (s or "").strip()
     # Enlève l'enrobage Excel ="4 D"
-    m = re.match(r'^=\s*"(.+)"\s*$', s)
+    m = RE_EXCEL.match(s)
     if m: s = m.group(1)
-    # Unicode -> supprime diacritiques ; majuscules
-    s = unicodedata.normalize("NFD", s)
-    s = "".join(ch for ch in s if unicodedata.category(ch) != "Mn").upper()
+    # Décomposition Unicode seulement si nécessaire : la plupart des
+    # divisions ("4D", "4 D"…) sont déjà ASCII
+    if not s.isascii():
+        s = unicodedata.normalize("NFD", s)
+        s = "".join(ch for ch in s if unicodedata.category(ch) != "Mn")
+    s = s.upper()
     # Uniformise : retire espaces/tirets/points "4 ÈME D" -> "4EMED"
-    s = s.replace("ÈME","E").replace("EME","E")
-    s = re.sub(r"[\s\-.]+","", s)
+    # (après suppression des diacritiques, "ÈME" est déjà devenu "EME")
+    s = s.replace("EME","E")
+    s = RE_SEP.sub("", s)
     return s
 
 with open(src, "r", encoding="utf-8-sig", newline="") as f:
@@ -24,13 +32,17 @@ sep = ";" if sample.count(";") >= sample.count(",") else ","
 
 with open(src, "r", encoding="utf-8-sig", newline="") as f, \
      open(dst, "w", encoding="utf-8", newline="") as g:
-    rdr = csv.DictReader(f, delimiter=sep)
-    fieldnames = rdr.fieldnames or []
-    if "Division" not in fieldnames: raise SystemExit("Colonne 'Division' absente.")
-    w = csv.DictWriter(g, fieldnames=fieldnames, delimiter=sep)
-    w.writeheader()
+    # csv.reader positionnel : seule la colonne Division change, inutile de
+    # payer un dict par ligne comme avec DictReader/DictWriter
+    rdr = csv.reader(f, delimiter=sep)
+    header = next(rdr, None)
+    if not header or "Division" not in header: raise SystemExit("Colonne 'Division' absente.")
+    div_idx = header.index("Division")
+    w = csv.writer(g, delimiter=sep)
+    w.writerow(header)
     for row in rdr:
-        row["Division"] = normalize_div(row.get("Division",""))
+        if len(row) > div_idx:
+            row[div_idx] = normalize_div(row[div_idx])
         w.writerow(row)
 
 print("✅ Division normalisée →", dst)
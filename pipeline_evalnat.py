@@ -16,6 +16,7 @@ Pipeline EvalNat — orchestre tes 4 scripts existants dans le bon ordre :
 #       --add-data "merge_parents_4e.py:." \
 #       --add-data "build_mailmerge_4e_from_merged_v5.py:." \
 #       --add-data "tb_mailmerge_mac.py:." \
+#       --add-data "tb_core.py:." \
 #       pipeline_evalnat.py
 
 Usage (exemple) :
@@ -35,7 +36,7 @@ Par défaut :
 - tu peux fournir un message commun aux parents via --message-text ou --message-file (remplit/écrase la colonne 'CorpsMessage').
 """
 
-import argparse, sys, os, subprocess, shutil, csv, re, unicodedata, runpy, importlib, textwrap
+import argparse, functools, sys, os, subprocess, shutil, csv, re, unicodedata, runpy, importlib, textwrap
 # --- Forcer l'inclusion de pandas dans le binaire (utilisé par merge_parents_4e) ---
 # Lorsque merge_parents_4e.py est chargé depuis un fichier embarqué (--add-data),
 # PyInstaller n'analyse pas ses imports → pandas ne serait pas collecté.
@@ -52,6 +53,7 @@ from pathlib import Path
 BASE_DIR = Path(__file__).resolve().parent  # dossier contenant le pipeline
 
 # --- Helpers pour exécution en mode gelé (PyInstaller onefile) -------------
+@functools.lru_cache(maxsize=None)
 def _resource_path(rel: str = "") -> str:
     """
     Retourne le chemin absolu d'une ressource embarquée lorsque le script est gelé.
@@ -70,6 +72,7 @@ def _ensure_meipass_on_syspath():
         sys.path.insert(0, meipass)
 
 # --- Helper générique pour importer un module embarqué ou via fichier -------
+@functools.lru_cache(maxsize=None)
 def import_generic_module(modname: str, filename: str):
     """
     Importe un module potentiellement embarqué en onefile.
@@ -78,6 +81,8 @@ def import_generic_module(modname: str, filename: str):
       2) ajouter _MEIPASS au sys.path et retenter
       3) charger explicitement depuis un fichier embarqué via --add-data
     `filename` est le nom du fichier embarqué (ex: 'merge_parents_4e.py').
+    Mémoïsé : les appels répétés (pipeline en batch) ne repayent ni les
+    tentatives d'import ni le sondage du système de fichiers.
     """
     # 1) import direct si dispo
     try:
@@ -109,11 +114,20 @@ BUILD_MM_MODULE = "build_mailmerge_4e_from_merged_v5"
 TB_MODULE       = "tb_mailmerge_mac"
 
 # Helper to run a module with argv
-def run_module_with_argv(modname: str, argv: list[str]) -> int:
+def run_module_with_argv(modname: str, argv: list[str], mod=None) -> int:
     """
     Exécute un module comme s'il était appelé en ligne de commande.
-    Simule: python -m modname <argv...>
+    Si le module expose main(argv), on l'appelle directement : pas de
+    ré-exécution du code top-level (imports compris) comme avec runpy.
+    Sinon, simule: python -m modname <argv...>
     """
+    main_fn = getattr(mod, "main", None) if mod is not None else None
+    if main_fn is None:
+        m = sys.modules.get(modname)
+        main_fn = getattr(m, "main", None) if m is not None else None
+    if callable(main_fn):
+        rc = main_fn(argv)
+        return int(rc or 0)
     old_argv = sys.argv[:]
     try:
         sys.argv = [modname] + argv
@@ -123,81 +137,137 @@ def run_module_with_argv(modname: str, argv: list[str]) -> int:
         sys.argv = old_argv
 
 # --- Helpers ---------------------------------------------------------------
-def detect_sep(p: Path) -> str:
-    with open(p, "r", encoding="utf-8-sig", newline="") as f:
+_RE_CRLF = re.compile(r"\r\n?")
+_RE_NONALNUM = re.compile(r"[^a-z0-9]+")
+_RE_EQQUOTED = re.compile(r'^=\s*"(.+)"\s*$')   # enrobage Excel ="4 D"
+_RE_SEP = re.compile(r"[\s\-.]+")
+
+@functools.lru_cache(maxsize=32)
+def _detect_sep_cached(path: str, mtime_ns: int, size: int) -> str:
+    # mtime/size dans la clé : le cache s'invalide si le fichier change
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
         s = f.read(4096)
     return ";" if s.count(";") >= s.count(",") else ","
 
-def nfd(s: str) -> str:
-    return unicodedata.normalize("NFD", s or "")
+def detect_sep(p: Path) -> str:
+    st = os.stat(p)
+    return _detect_sep_cached(str(p), st.st_mtime_ns, st.st_size)
 
+@functools.lru_cache(maxsize=8192)
 def squash(s: str) -> str:
-    s = nfd(s).lower()
-    s = "".join(ch for ch in s if unicodedata.category(ch) != "Mn")
-    return re.sub(r"[^a-z0-9]+", "", s)
-
-def count_pdfs_by_disc(base: Path, classe: str, annee: str) -> dict:
+    # Mémoïsé : squash est appelé 3× par ligne (division/nom/prénom) dans la
+    # construction de emails_index puis dans l'enrichissement du mailmerge ;
+    # les mêmes valeurs reviennent sans cesse (division constante, fratries).
+    s = (s or "").lower()
+    # Fast path : les chaînes ASCII n'ont ni accents ni marques combinantes,
+    # inutile de payer la normalisation Unicode (cas majoritaire sur les noms).
+    if not s.isascii():
+        # NFKD + transcodage ASCII : le filtre des marques combinantes
+        # s'exécute en C dans le codec, pas en boucle Python par caractère.
+        s = unicodedata.normalize("NFKD", s).encode("ascii", "ignore").decode("ascii")
+    return _RE_NONALNUM.sub("", s)
+
+@functools.lru_cache(maxsize=4096)
+def _norm_div(s: str) -> str:
     """
-    Retourne un dict {'francais': n, 'maths': n} en scannant base.
-    Tolère les variantes 'Français/Francais/Franais' & 'Mathématiques/Mathematiques/Mathmatiques/Maths'.
+    Normalise une division "4 D"/="4 D"/4ème D → 4D.
+    Mémoïsée : un CSV parents contient < 10 divisions distinctes répétées
+    sur des milliers de lignes, la normalisation ne se paie qu'une fois.
     """
-    discs_fr = ("Français","Francais","Franais")
-    discs_ma = ("Mathématiques","Mathematiques","Mathmatiques","Maths")
-    n_fr = n_ma = 0
-    for p in base.glob(f"{classe}_*_{annee}.pdf"):
-        name = p.name
-        # on regarde l'avant-dernier segment (discipline) si possible
-        parts = name[:-4].split("_")  # drop .pdf
-        if len(parts) >= 4:
-            disc = parts[-2]
-            if disc in discs_fr: n_fr += 1
-            if disc in discs_ma: n_ma += 1
-    return {"francais": n_fr, "maths": n_ma}
-
-# --- Helper pour inspecter les classes/années présentes dans les PDFs générés
-def scan_pdf_labels(base: Path) -> tuple[set[str], set[str]]:
+    m = _RE_EQQUOTED.match(s)
+    if m: s = m.group(1)
+    if not s.isascii():
+        s = unicodedata.normalize("NFKD", s).encode("ascii", "ignore").decode("ascii")
+    # après suppression des diacritiques, "ÈME" est déjà devenu "EME"
+    sN = s.upper().replace("EME","E")
+    return _RE_SEP.sub("", sN)
+
+# Motif des PDFs générés : <classe>_<nom...>_<discipline>_<AAAA-AAAA>.pdf
+_PAT = re.compile(r"^([^_]+)_.+_([^_]+)_(\d{4}-\d{4})\.pdf$")
+_FR = frozenset({"Français", "Francais", "Franais"})
+_MA = frozenset({"Mathématiques", "Mathematiques", "Mathmatiques", "Maths"})
+
+def scan_all(base: Path, classe: str, annee: str):
     """
-    Analyse les noms de fichiers dans 'base' pour en extraire:
-      - les classes vues (prefixe avant premier '_')
-      - les années vues (dernier segment AAAA-AAAA)
-    Retourne (classes, annees).
+    Un seul parcours récursif de 'base' pour tout ce dont l'étape 1 a besoin :
+      - un booléen « au moins un PDF présent »
+      - les chemins des PDFs de la classe demandée
+      - les classes vues (préfixe avant premier '_') et les années vues
+        (dernier segment AAAA-AAAA)
+      - le comptage préflight {'francais': n, 'maths': n} pour la classe/année
+        (tolère 'Français/Francais/Franais' & 'Mathématiques/.../Maths')
+    Remplace trois traversées distinctes du même dossier.
+    Retourne (any_pdf, this_class_pdfs, classes, annees, counts).
     """
+    this_class: list[Path] = []
     classes: set[str] = set()
     annees: set[str] = set()
-    for p in base.glob("*.pdf"):
-        name = p.name[:-4]  # sans .pdf
-        parts = name.split("_")
-        if len(parts) >= 2:
-            classes.add(parts[0])
-        # année attendue en dernier segment
-        if len(parts) >= 2:
-            annees.add(parts[-1])
-    return classes, annees
+    any_pdf = False
+    n_fr = n_ma = 0
+    prefix = f"{classe}_"
+    for root, _dirs, files in os.walk(base):
+        for name in files:
+            if not name.endswith(".pdf"):
+                continue
+            any_pdf = True
+            parts = name[:-4].split("_")
+            if len(parts) >= 2:
+                classes.add(parts[0])
+                # année attendue en dernier segment
+                annees.add(parts[-1])
+            if name.startswith(prefix):
+                this_class.append(Path(root) / name)
+                m = _PAT.match(name)
+                if m and m.group(3) == annee:
+                    disc = m.group(2)
+                    n_fr += disc in _FR
+                    n_ma += disc in _MA
+    return any_pdf, this_class, classes, annees, {"francais": n_fr, "maths": n_ma}
 
 # --- OCR helpers -----------------------------------------------------------
 def quick_text_ratio(pdf_path: Path, max_pages: int = 6) -> float:
     """
     Renvoie un ratio 'caractères extraits / pages examinées'.
     Si ~0 → PDF probablement scanné (pas de texte).
-    Essaie pdfminer; à défaut, PyPDF2.
+    Sonde uniquement les `max_pages` premières pages — jamais le document
+    entier. Essaie pypdfium2 puis PyMuPDF (les plus rapides s'ils sont
+    installés), puis pdfminer, puis PyPDF2.
     """
-    # Tentative avec pdfminer
+    # Tentative avec pypdfium2
+    try:
+        import pypdfium2 as pdfium  # type: ignore
+        pdf = pdfium.PdfDocument(str(pdf_path))
+        try:
+            pages = min(len(pdf), max_pages)
+            chars = sum(
+                len((pdf[i].get_textpage().get_text_range() or "").strip())
+                for i in range(pages)
+            )
+            return chars / max(pages, 1)
+        finally:
+            pdf.close()
+    except Exception:
+        pass
+    # Tentative avec PyMuPDF
+    try:
+        import fitz  # type: ignore
+        with fitz.open(str(pdf_path)) as doc:
+            pages = min(doc.page_count, max_pages)
+            chars = sum(len((doc[i].get_text() or "").strip()) for i in range(pages))
+            return chars / max(pages, 1)
+    except Exception:
+        pass
+    # Tentative avec pdfminer (borné à max_pages, pas d'extraction globale)
     try:
         from pdfminer.high_level import extract_text  # type: ignore
         from pdfminer.pdfpage import PDFPage  # type: ignore
-        chars = 0
-        pages = 0
-        # On lit rapidement le texte global puis on approxime par page vue
-        txt = extract_text(str(pdf_path)) or ""
-        # Compter un petit nombre de pages pour l'échantillon
+        txt = extract_text(str(pdf_path), maxpages=max_pages) or ""
+        # Diviser par les pages réellement sondées, pas par la borne : un PDF
+        # de 2 pages divisé par 6 verrait son ratio sous-estimé 3× et pourrait
+        # passer sous le seuil OCR alors qu'il est parfaitement textuel.
         with open(pdf_path, "rb") as f:
-            for i, _ in enumerate(PDFPage.get_pages(f)):
-                if i >= max_pages:
-                    break
-                pages += 1
-        pages = max(pages, 1)
-        chars = len((txt or "").strip())
-        return chars / pages
+            pages = sum(1 for _ in PDFPage.get_pages(f, maxpages=max_pages))
+        return len(txt.strip()) / max(pages, 1)
     except Exception:
         pass
     # Fallback PyPDF2
@@ -227,9 +297,12 @@ def run_ocrmypdf(src: Path, dst: Path, lang: str = "fra"):
     - --rotate-pages / --deskew : oriente et redresse
     - --clean-final : nettoie le fond
     - --skip-text : skip si déjà texte (optimisation)
+    - --jobs : tesseract est parallélisable page par page, on utilise tous les cœurs
     """
+    jobs = os.cpu_count() or 2
     cmd = ["ocrmypdf", "--force-ocr", "--rotate-pages", "--deskew",
            "--clean-final", "--skip-text", f"--language={lang}",
+           f"--jobs={jobs}", "--optimize=1",
            str(src), str(dst)]
     print("▶ ocrmypdf:", " ".join(cmd))
     subprocess.check_call(cmd)
@@ -237,36 +310,17 @@ def run_ocrmypdf(src: Path, dst: Path, lang: str = "fra"):
 def import_split_module():
     """
     Importe le module de découpage, y compris lorsqu'on est packagé en onefile.
-    Ordre d'essai:
-      1) import normal (module présent dans l'environnement)
-      2) import depuis le répertoire d'extraction PyInstaller (_MEIPASS)
-         où le fichier 'split_4C.py' peut avoir été embarqué via --add-data.
+    Délègue à import_generic_module (même chaîne d'essais, et mémoïsé).
     """
-    # 1) import direct si disponible
     try:
-        return importlib.import_module(SPLIT_MODULE)
-    except Exception as e_first:
-        # 2) tenter depuis _MEIPASS
-        _ensure_meipass_on_syspath()
-        try:
-            return importlib.import_module(SPLIT_MODULE)
-        except Exception:
-            # 3) chargement explicite depuis un chemin fichier
-            import importlib.util
-            split_path = Path(_resource_path("split_4C.py"))
-            if split_path.exists():
-                spec = importlib.util.spec_from_file_location(SPLIT_MODULE, str(split_path))
-                if spec and spec.loader:
-                    mod = importlib.util.module_from_spec(spec)
-                    spec.loader.exec_module(mod)  # type: ignore
-                    return mod
-            # si on arrive ici, le module est vraiment introuvable
-            raise ImportError(
-                "[ERREUR] split_4C introuvable. "
-                "Rebuild du pipeline en embarquant le fichier :\n"
-                "  python -m PyInstaller --onefile --console --name evalnat-pipeline \\\n"
-                "    --add-data 'split_4C.py:.' pipeline_evalnat.py"
-            ) from e_first
+        return import_generic_module(SPLIT_MODULE, "split_4C.py")
+    except ImportError as e:
+        raise ImportError(
+            "[ERREUR] split_4C introuvable. "
+            "Rebuild du pipeline en embarquant le fichier :\n"
+            "  python -m PyInstaller --onefile --console --name evalnat-pipeline \\\n"
+            "    --add-data 'split_4C.py:.' pipeline_evalnat.py"
+        ) from e
 
 def import_merge_parents_module():
     return import_generic_module(MERGE_MODULE, "merge_parents_4e.py")
@@ -282,8 +336,8 @@ def run_build_mailmerge(inp_csv: Path, pdf_base: Path, annee: str, out_csv: Path
     print("▶ build_mailmerge (module):", BUILD_MM_MODULE, " ".join(argv))
     # Essayer import module; sinon exécuter le fichier embarqué
     try:
-        import_generic_module(BUILD_MM_MODULE, "build_mailmerge_4e_from_merged_v5.py")
-        run_module_with_argv(BUILD_MM_MODULE, argv)
+        mod = import_generic_module(BUILD_MM_MODULE, "build_mailmerge_4e_from_merged_v5.py")
+        run_module_with_argv(BUILD_MM_MODULE, argv, mod)
     except ImportError:
         # Fallback: exécution par chemin fichier
         path = Path(_resource_path("build_mailmerge_4e_from_merged_v5.py"))
@@ -314,8 +368,8 @@ def run_tb(csv_file: Path, sleep: float, limit: int|None, skip: int, dry_run: bo
         argv += ["--tb-binary", tb_binary]
     print("▶ tb_mailmerge (module):", TB_MODULE, " ".join(argv))
     try:
-        import_generic_module(TB_MODULE, "tb_mailmerge_mac.py")
-        run_module_with_argv(TB_MODULE, argv)
+        mod = import_generic_module(TB_MODULE, "tb_mailmerge_mac.py")
+        run_module_with_argv(TB_MODULE, argv, mod)
     except ImportError:
         path = Path(_resource_path("tb_mailmerge_mac.py"))
         if not path.exists():
@@ -448,13 +502,12 @@ def run_pipeline(argv_list: list[str] | None = None):
         split_mod.KEEP_ACCENTS_IN_FILENAME = bool(args.keep_accents)
         split_mod.split_pdf()
 
-    # Vérif: on doit avoir des PDFs pour la classe, et uniquement cette classe
-    generated = list(out_dir.rglob("*.pdf"))
-    if not generated:
+    # Vérif: on doit avoir des PDFs pour la classe, et uniquement cette classe.
+    # Un seul parcours du dossier donne tout : total, PDFs de la classe,
+    # classes/années réellement vues et comptage préflight.
+    any_pdf, this_class_pdfs, classes_seen, years_seen, counts = scan_all(out_dir, classe, annee)
+    if not any_pdf:
         raise SystemExit("Aucun PDF trouvé dans le dossier de sortie. Vérifie --out-dir et l'étape de split.")
-    # classes/années réellement vues
-    classes_seen, years_seen = scan_pdf_labels(out_dir)
-    this_class_pdfs = [p for p in generated if p.name.startswith(f"{classe}_")]
     if not this_class_pdfs:
         msg = []
         msg.append("Aucun PDF ne correspond à la classe demandée.")
@@ -500,44 +553,68 @@ def run_pipeline(argv_list: list[str] | None = None):
     # Canoniser/filtrer le CSV parents pour la classe
     canon_csv = cwd / f"parents_{classe}_canon.csv"
     sep = detect_sep(parents_csv)
+    classe_up = classe.upper()
     kept = 0
-    with open(parents_csv, "r", encoding="utf-8-sig", newline="") as f, \
-         open(canon_csv, "w", encoding="utf-8", newline="") as g:
-        rdr = csv.DictReader(f, delimiter=sep)
-        fields = rdr.fieldnames or []
-        # on garde toutes les colonnes + on normalise Division sur '4D' etc.
-        w = csv.DictWriter(g, fieldnames=fields, delimiter=sep)
-        w.writeheader()
-        for r in rdr:
-            div = (r.get("Division") or r.get("Classe") or "").strip()
-            # normalisation "4 D"/="4 D"/4ème D → 4D
-            m = re.match(r'^=\s*"(.+)"\s*$', div)
-            if m: div = m.group(1)
-            divN = unicodedata.normalize("NFD", div).upper()
-            divN = "".join(ch for ch in divN if unicodedata.category(ch) != "Mn")
-            divN = divN.replace("ÈME","E").replace("EME","E")
-            divN = re.sub(r"[\s\-.]+","", divN)
-            if divN == classe.upper():
-                r["Division"] = classe
-                w.writerow(r); kept += 1
+    try:
+        import pandas as pd  # type: ignore
+    except Exception:
+        pd = None
+    if pd is not None:
+        # Voie vectorisée : parsing CSV en C + opérations Series.str sur la
+        # colonne Division, plutôt qu'un DictReader/DictWriter ligne à ligne
+        # avec normalisation Unicode en Python pur.
+        df = pd.read_csv(parents_csv, sep=sep, dtype=str,
+                         keep_default_na=False, encoding="utf-8-sig")
+        div = df["Division"] if "Division" in df.columns else pd.Series("", index=df.index, dtype=str)
+        if "Classe" in df.columns:
+            div = div.where(div.str.strip() != "", df["Classe"])
+        # normalisation "4 D"/="4 D"/4ème D → 4D
+        div = div.str.strip().str.replace(r'^=\s*"(.+)"\s*$', r"\1", regex=True)
+        # NFKD + transcodage ASCII : les marques combinantes tombent d'un coup
+        # ("ÈME" devient "EME" au passage)
+        divN = (div.str.normalize("NFKD")
+                   .str.encode("ascii", "ignore").str.decode("ascii")
+                   .str.upper().str.replace("EME", "E")
+                   .str.replace(r"[\s\-.]+", "", regex=True))
+        mask = divN == classe_up
+        kept = int(mask.sum())
+        df.loc[mask, "Division"] = classe
+        df.loc[mask].to_csv(canon_csv, sep=sep, index=False, encoding="utf-8")
+        divs_seen = {d for d in divN.unique() if d}
+    else:
+        # Diagnostic collecté au fil de l'eau : évite de relire tout le CSV
+        # une seconde fois quand aucune ligne ne correspond.
+        divs_seen = set()
+        # buffering 1 Mio : regroupe les write() en quelques syscalls
+        with open(parents_csv, "r", encoding="utf-8-sig", newline="", buffering=1 << 20) as f, \
+             open(canon_csv, "w", encoding="utf-8", newline="", buffering=1 << 20) as g:
+            # csv.reader positionnel : seule la colonne Division change,
+            # inutile de payer un dict par ligne comme avec DictReader/DictWriter
+            rdr = csv.reader(f, delimiter=sep)
+            header = next(rdr, None) or []
+            idx = {h: i for i, h in enumerate(header)}
+            i_div = idx.get("Division", -1)
+            i_cla = idx.get("Classe", -1)
+            # on garde toutes les colonnes + on normalise Division sur '4D' etc.
+            w = csv.writer(g, delimiter=sep)
+            w.writerow(header)
+            for row in rdr:
+                n = len(row)
+                div = ((row[i_div] if 0 <= i_div < n else "")
+                       or (row[i_cla] if 0 <= i_cla < n else "")).strip()
+                # normalisation "4 D"/="4 D"/4ème D → 4D (mémoïsée)
+                divN = _norm_div(div)
+                if divN:
+                    divs_seen.add(divN)
+                if divN == classe_up:
+                    if 0 <= i_div < n:
+                        row[i_div] = classe
+                    w.writerow(row); kept += 1
     if kept == 0:
         # garde anti-mismatch: on s'arrête ici avec un message explicite
         # pour éviter de construire un CSV vide et de perdre du temps
         # (ex: CSV 6A fourni alors que --classe=4D)
-        # Diagnostic: lister les divisions distinctes vues dans le CSV source
-        divs = set()
-        with open(parents_csv, "r", encoding="utf-8-sig", newline="") as f:
-            rdr = csv.DictReader(f, delimiter=sep)
-            for r in rdr:
-                d = (r.get("Division") or r.get("Classe") or "").strip()
-                if d:
-                    # normaliser rapidement pour indiquer quelles valeurs existent
-                    dN = unicodedata.normalize("NFD", d).upper()
-                    dN = "".join(ch for ch in dN if unicodedata.category(ch) != "Mn")
-                    dN = dN.replace("ÈME","E").replace("EME","E")
-                    dN = re.sub(r"[\s\-.]+","", dN)
-                    divs.add(dN)
-        hint = f"Divisions présentes dans le CSV: {', '.join(sorted(divs))}" if divs else "Aucune division détectée dans le CSV."
+        hint = f"Divisions présentes dans le CSV: {', '.join(sorted(divs_seen))}" if divs_seen else "Aucune division détectée dans le CSV."
         raise SystemExit(
             "Garde anti-mismatch : aucune ligne de parents ne correspond à la classe demandée.\n"
             f"  • Classe demandée : {classe}\n"
@@ -550,7 +627,7 @@ def run_pipeline(argv_list: list[str] | None = None):
 
     # --- Préflight de comptage (avant build) -----------------------------------
     if kept > 0:
-        counts = count_pdfs_by_disc(out_dir, classe, annee)
+        # counts vient du parcours unique de scan_all (étape 1)
         eff = kept  # effectif attendu pour la classe (lignes parents)
         ratio_fr = counts["francais"] / eff if eff else 0.0
         ratio_ma = counts["maths"] / eff if eff else 0.0
@@ -578,71 +655,190 @@ def run_pipeline(argv_list: list[str] | None = None):
     # === Étape 3 bis — Compléter Emails et vérifier PJ ========================
     mm_with_emails = mailmerge_csv.with_name(f"mailmerge_{classe}_with_emails.csv")
 
-    # Construire un index Emails depuis canon_csv
-    emails_index = {}
-    sep_canon = detect_sep(canon_csv)
-    with open(canon_csv, "r", encoding="utf-8-sig", newline="") as f:
-        rdr = csv.DictReader(f, delimiter=sep_canon)
-        for r in rdr:
-            div = (r.get("Division") or r.get("Classe") or "").strip()
-            nom = (r.get("Nom de famille") or r.get("Nom") or "").strip()
-            pre = (r.get("Prénom 1") or r.get("Prénom") or r.get("Prenom") or "").strip()
-            if not (div and nom and pre): 
-                continue
-            key = (squash(div), squash(nom), squash(pre))
-            e1 = (r.get("Courriel repr. légal") or "").strip()
-            e2 = (r.get("Courriel autre repr. légal") or "").strip()
-            em = "; ".join([e for e in [e1, e2] if e])
-            if em:
-                emails_index[key] = em
-
+    # canon_csv vient d'être écrit par ce pipeline avec `sep` : inutile de
+    # relire 4 Kio du disque pour re-détecter un séparateur déjà connu.
+    sep_canon = sep
     sep_mm = detect_sep(mailmerge_csv)
-    rows = []
+    # Paires (nom, valeur de colonne PJ) collectées au fil de l'eau pour la
+    # vérification des pièces jointes : évite une seconde passe sur rows avec
+    # 3 r.get() par ligne.
+    att_check: list[tuple[str, str]] = []
     filled = empty = 0
-    with open(mailmerge_csv, "r", encoding="utf-8", newline="") as f:
-        rdr = csv.DictReader(f, delimiter=sep_mm)
-        fields = list(rdr.fieldnames or [])
-        # S'assurer que les colonnes 'CorpsMessage' et 'Emails' existent
-        if "CorpsMessage" not in fields:
-            fields.insert(0, "CorpsMessage")
-        if "Emails" not in fields:
-            fields.insert(0, "Emails")
-        for r in rdr:
-            div = (r.get("Classe") or r.get("Division") or "").strip()
-            nom = (r.get("Nom") or "").strip()
-            pre = (r.get("Prénom") or r.get("Prenom") or "").strip()
-            key = (squash(div), squash(nom), squash(pre))
-            if not (r.get("Emails") or "").strip():
-                r["Emails"] = emails_index.get(key, "")
-            if r["Emails"]: filled += 1
-            else:           empty  += 1
-            # Injecter le message commun si demandé
-            if message_common is not None:
-                r["CorpsMessage"] = message_common
-            else:
-                # S'assurer que la clé existe (même vide) pour la compatibilité TB
-                r.setdefault("CorpsMessage", r.get("CorpsMessage", ""))
-            rows.append(r)
-
-    with open(mm_with_emails, "w", encoding="utf-8", newline="") as g:
-        w = csv.DictWriter(g, fieldnames=fields, delimiter=sep_mm)
-        w.writeheader(); w.writerows(rows)
+    if pd is not None:
+        # Voie vectorisée : jointure hachée pandas sur une clé normalisée
+        # (équivalent de squash) au lieu de deux boucles DictReader + dict.
+        def _squash_series(s):
+            return (s.fillna("").astype(str)
+                     .str.normalize("NFKD")
+                     .str.encode("ascii", "ignore").str.decode("ascii")
+                     .str.lower().str.replace(r"[^a-z0-9]+", "", regex=True))
+
+        def _col(df, *names):
+            for n in names:
+                if n in df.columns:
+                    return df[n]
+            return pd.Series("", index=df.index, dtype=str)
+
+        canon = pd.read_csv(canon_csv, sep=sep_canon, dtype=str,
+                            keep_default_na=False, encoding="utf-8-sig")
+        div_c = _col(canon, "Division", "Classe").str.strip()
+        nom_c = _col(canon, "Nom de famille", "Nom").str.strip()
+        pre_c = _col(canon, "Prénom 1", "Prénom", "Prenom").str.strip()
+        key_c = (_squash_series(div_c) + "|" + _squash_series(nom_c)
+                 + "|" + _squash_series(pre_c))
+        e1 = _col(canon, "Courriel repr. légal").str.strip()
+        e2 = _col(canon, "Courriel autre repr. légal").str.strip()
+        em = e1.where(e2 == "", e1 + "; " + e2).where(e1 != "", e2)
+        lut = pd.DataFrame({"_k": key_c, "_em": em})
+        # mêmes règles que l'index dict : clé complète, email non vide,
+        # la dernière occurrence d'une clé gagne
+        lut = lut[(div_c != "") & (nom_c != "") & (pre_c != "") & (em != "")]
+        lut = lut.drop_duplicates("_k", keep="last")
+
+        mm = pd.read_csv(mailmerge_csv, sep=sep_mm, dtype=str,
+                         keep_default_na=False, encoding="utf-8")
+        mm["_k"] = (_squash_series(_col(mm, "Classe", "Division"))
+                    + "|" + _squash_series(_col(mm, "Nom"))
+                    + "|" + _squash_series(_col(mm, "Prénom", "Prenom")))
+        mm = mm.merge(lut, on="_k", how="left")
+        if "Emails" not in mm.columns:
+            mm["Emails"] = ""
+        emails = mm["Emails"].str.strip()
+        mm["Emails"] = emails.where(emails != "", mm["_em"].fillna(""))
+        filled = int((mm["Emails"] != "").sum())
+        empty = len(mm) - filled
+        if message_common is not None:
+            mm["CorpsMessage"] = message_common
+        else:
+            if "CorpsMessage" not in mm.columns:
+                mm["CorpsMessage"] = ""
+            mm["CorpsMessage"] = mm["CorpsMessage"].str.replace(_RE_CRLF, "\n", regex=True)
+        noms = _col(mm, "Nom").str.strip().tolist()
+        for col in ("PJ_francais", "PJ_math", "Attachments"):
+            if col in mm.columns:
+                for nom, pj in zip(noms, mm[col].tolist()):
+                    if pj:
+                        att_check.append((nom or "?", pj))
+        mm.drop(columns=["_k", "_em"], inplace=True)
+        mm.to_csv(mm_with_emails, sep=sep_mm, index=False, encoding="utf-8")
+    else:
+        # Construire un index Emails depuis canon_csv.
+        # csv.reader + indices de colonnes précalculés : pas de dict alloué
+        # (ni de hachage des en-têtes) pour chaque ligne.
+        emails_index = {}
+        with open(canon_csv, "r", encoding="utf-8-sig", newline="") as f:
+            rdr = csv.reader(f, delimiter=sep_canon)
+            header = next(rdr, None) or []
+            idx = {h: i for i, h in enumerate(header)}
+            i_div, i_cla = idx.get("Division", -1), idx.get("Classe", -1)
+            i_nom, i_nom2 = idx.get("Nom de famille", -1), idx.get("Nom", -1)
+            i_pre = idx.get("Prénom 1", -1)
+            i_pre2, i_pre3 = idx.get("Prénom", -1), idx.get("Prenom", -1)
+            i_e1 = idx.get("Courriel repr. légal", -1)
+            i_e2 = idx.get("Courriel autre repr. légal", -1)
+
+            def _g(row, i):
+                return row[i] if 0 <= i < len(row) else ""
+
+            for row in rdr:
+                div = (_g(row, i_div) or _g(row, i_cla)).strip()
+                nom = (_g(row, i_nom) or _g(row, i_nom2)).strip()
+                pre = (_g(row, i_pre) or _g(row, i_pre2) or _g(row, i_pre3)).strip()
+                if not (div and nom and pre):
+                    continue
+                key = (squash(div), squash(nom), squash(pre))
+                e1 = _g(row, i_e1).strip()
+                e2 = _g(row, i_e2).strip()
+                # Deux champs au plus : l'expression conditionnelle évite la
+                # liste temporaire + le join par ligne.
+                em = e1 if not e2 else (e2 if not e1 else e1 + "; " + e2)
+                if em:
+                    emails_index[key] = em
+
+        # Flux direct lecteur → écrivain : la transformation est locale à la
+        # ligne, inutile de matérialiser toutes les lignes en mémoire.
+        with open(mailmerge_csv, "r", encoding="utf-8", newline="", buffering=1 << 20) as f, \
+             open(mm_with_emails, "w", encoding="utf-8", newline="", buffering=1 << 20) as g:
+            rdr = csv.DictReader(f, delimiter=sep_mm)
+            fields = list(rdr.fieldnames or [])
+            # S'assurer que les colonnes 'CorpsMessage' et 'Emails' existent
+            if "CorpsMessage" not in fields:
+                fields.insert(0, "CorpsMessage")
+            if "Emails" not in fields:
+                fields.insert(0, "Emails")
+            w = csv.DictWriter(g, fieldnames=fields, delimiter=sep_mm)
+            w.writeheader()
+            # Liaisons hoistées hors boucle : évite les lookups globaux/attributs
+            # répétés sur N lignes ('Classe' d'abord : c'est la colonne que le
+            # mailmerge émet, 'Division' ne sert que de secours).
+            _eix_get = emails_index.get
+            _squash = squash
+            for r in rdr:
+                rget = r.get
+                div = rget("Classe") or rget("Division")
+                pre = rget("Prénom") or rget("Prenom")
+                nom = rget("Nom")
+                nom = nom.strip() if nom else ""   # réutilisé par att_check
+                key = (_squash(div.strip() if div else ""),
+                       _squash(nom),
+                       _squash(pre.strip() if pre else ""))
+                emails = rget("Emails")
+                emails = emails.strip() if emails else ""
+                if not emails:
+                    emails = _eix_get(key, "")
+                r["Emails"] = emails
+                if emails: filled += 1
+                else:      empty  += 1
+                # Injecter le message commun si demandé ; il est déjà normalisé
+                # (CR/LF) une fois pour toutes avant la boucle — rien à refaire ici.
+                if message_common is not None:
+                    r["CorpsMessage"] = message_common
+                else:
+                    # Corps propre à la ligne : normaliser les retours Windows en
+                    # une seule passe regex (au lieu de deux str.replace).
+                    corps = r.get("CorpsMessage") or ""
+                    r["CorpsMessage"] = _RE_CRLF.sub("\n", corps) if "\r" in corps else corps
+                for col in ("PJ_francais", "PJ_math", "Attachments"):
+                    pj = r.get(col, "")
+                    if pj:
+                        att_check.append((nom or "?", pj))
+                w.writerow(r)
 
     print(f"✅ Emails remplis: {filled} | manquants: {empty} → {mm_with_emails}")
     if message_common is not None:
         preview = (message_common[:80] + "…") if len(message_common) > 80 else message_common
         print(f"✅ Message commun appliqué à toutes les lignes (Colonne 'CorpsMessage'). Aperçu: {preview!r}")
 
-    # Vérification des pièces jointes
+    # Vérification des pièces jointes (sur les paires pré-collectées).
+    # Un seul parcours de out_dir remplace un stat() par PJ et par ligne :
+    # l'existence se teste ensuite en O(1) dans un set en mémoire.
+    out_root = str(out_dir.resolve())
+    existing: set[str] = set()
+    existing_names: set[str] = set()
+    for root, _dirs, files in os.walk(out_root):
+        for name in files:
+            if name.endswith(".pdf"):
+                existing.add(os.path.join(root, name))
+                existing_names.add(name)
     missing_pj = []
-    for r in rows:
-        for col in ("PJ_francais", "PJ_math", "Attachments"):
-            pj = r.get(col, "")
-            if pj:
-                for path in pj.split(","):
-                    p = Path(path.strip())
-                    if path and not p.exists():
-                        missing_pj.append((r.get('Nom','?'), p.name))
+    # Mémo par chemin brut : la même PJ revient sur plusieurs lignes (documents
+    # partagés, colonne Attachments dupliquant PJ_*), on ne la vérifie qu'une fois.
+    checked: dict[str, bool] = {}
+    for nom, pj in att_check:
+        for path in pj.split(","):
+            path = path.strip()
+            if not path:
+                continue
+            ok = checked.get(path)
+            if ok is None:
+                ap = os.path.abspath(os.path.expanduser(path))
+                # PJ hors de out_dir (rare) : dernier recours, un stat classique
+                ok = (ap in existing
+                      or os.path.basename(ap) in existing_names
+                      or os.path.exists(ap))
+                checked[path] = ok
+            if not ok:
+                missing_pj.append((nom, os.path.basename(path)))
     if missing_pj:
         print(f"⚠️  {len(missing_pj)} pièces jointes introuvables (extraits) :")
         for n, f in missing_pj[:5]:
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+tb_core.py — helpers partagés par les deux pilotes Thunderbird
+(tb_mailmerge_mac.py et tb_mailmerge_open_compose_mac.py).
+
+Regroupe la lecture CSV en flux et la vérification des pièces jointes,
+qui étaient dupliquées à l'identique dans les deux scripts. Les
+échappements -compose restent dans chaque script : leurs styles
+(guillemets simples vs doubles) diffèrent volontairement selon le mode
+de lancement.
+
+Nota PyInstaller : si le binaire embarque tb_mailmerge_mac.py via
+--add-data, il faut aussi embarquer tb_core.py (voir l'en-tête de
+pipeline_evalnat.py).
+"""
+
+import csv
+import os
+
+def iter_csv(path, needed_cols):
+    """
+    Itère le CSV en flux : les indices des colonnes utiles sont résolus une
+    fois depuis l'en-tête, puis chaque ligne est produite comme un tuple
+    léger (dans l'ordre de needed_cols) — pas de dict DictReader par ligne.
+    Les valeurs sont déjà strip()ées : les boucles consommatrices n'ont
+    plus à repayer un strip par champ et par ligne.
+    """
+    # utf-8-sig : absorbe un éventuel BOM (export Excel) sans rien coûter sinon
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        r = csv.reader(f)
+        header = next(r, None) or []
+        pos = {h: i for i, h in enumerate(header)}
+        idxs = [pos.get(c, -1) for c in needed_cols]
+        for row in r:
+            n = len(row)
+            yield tuple(row[i].strip() if 0 <= i < n else "" for i in idxs)
+
+def ensure_abs(path: str) -> str:
+    if not path:
+        return ""
+    return os.path.abspath(os.path.expanduser(path))
+
+# Les PJ vivent en pratique dans un ou deux dossiers : on liste chaque dossier
+# une seule fois (os.scandir) au lieu d'un stat() par PJ et par ligne.
+_DIR_CACHE: dict = {}
+
+def attachment_exists(abs_path: str) -> bool:
+    d, name = os.path.split(abs_path)
+    files = _DIR_CACHE.get(d)
+    if files is None:
+        try:
+            with os.scandir(d or ".") as it:
+                files = frozenset(e.name for e in it if e.is_file())
+        except OSError:
+            files = frozenset()
+        _DIR_CACHE[d] = files
+    return name in files
@@ -18,7 +18,9 @@ Colonnes par défaut : Emails | Objet | Message | PJ_francais | PJ_math
 """
 
 import argparse
-import csv
+import collections
+import functools
+import itertools
 import os
 import re
 import shlex
@@ -26,6 +28,8 @@ import subprocess
 import sys
 import time
 
+from tb_core import attachment_exists, ensure_abs, iter_csv
+
 DEFAULT_MESSAGE = (
     "Madame, Monsieur,\n\n"
     "Veuillez trouver en pièces jointes les comptes rendus des évaluations nationales passées par vos enfants.\n"
@@ -35,7 +39,7 @@ DEFAULT_MESSAGE = (
     "Julien Texier"
 )
 
-def parse_args():
+def parse_args(argv=None):
     p = argparse.ArgumentParser(description="Ouvre des brouillons Thunderbird (macOS).")
     p.add_argument("--csv", required=True, help="Chemin du CSV d'entrée.")
     p.add_argument("--col-emails", default="Emails", help="Nom de la colonne Emails (défaut: Emails).")
@@ -44,13 +48,18 @@ def parse_args():
     p.add_argument("--col-att1", default="PJ_francais", help="Nom de la colonne PJ #1 (défaut: PJ_francais).")
     p.add_argument("--col-att2", default="PJ_math", help="Nom de la colonne PJ #2 (défaut: PJ_math).")
     p.add_argument("--sleep", type=float, default=0.6, help="Pause entre brouillons (sec).")
+    p.add_argument("--max-inflight", type=int, default=1,
+                   help="Nombre de lancements Thunderbird simultanés (défaut: 1 = séquentiel avec pause).")
     p.add_argument("--limit", type=int, default=None, help="Limiter au N premières lignes.")
     p.add_argument("--skip", type=int, default=0, help="Ignorer les N premières lignes.")
     p.add_argument("--dry-run", action="store_true", help="N'exécute pas, affiche les commandes.")
     p.add_argument("--force-default-body", action="store_true",
                    help="Ignore la colonne Message et utilise le message standard.")
     p.add_argument("--tb-binary", default=None, help="Chemin du binaire Thunderbird.")
-    return p.parse_args()
+    p.add_argument("--stream", action="store_true",
+                   help="Faire passer les lancements par un unique /bin/sh persistant "
+                        "(un seul spawn côté Python au lieu d'un par brouillon).")
+    return p.parse_args(argv)
 
 def find_tb_binary(user_choice=None):
     if user_choice:
@@ -65,55 +74,79 @@ def find_tb_binary(user_choice=None):
         return cand2
     raise FileNotFoundError("Binaire Thunderbird introuvable. Fournis-le via --tb-binary.")
 
+def _tb_process_alive():
+    return subprocess.run(["pgrep", "-x", "thunderbird"],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                          check=False).returncode == 0
+
 def ensure_tb_running(dry_run=False):
     # Lance l’app si elle n’est pas ouverte (sans args)
     cmd = ["open", "-ga", "Thunderbird"]
     if dry_run:
         print("[DRY-RUN] " + " ".join(shlex.quote(c) for c in cmd))
         return
+    # Déjà lancée (cas courant) → rien à attendre
+    if _tb_process_alive():
+        return
     subprocess.run(cmd, check=False)
-    # petite pause pour laisser l’app démarrer
-    time.sleep(1.2)
+    # Sonder le démarrage (50 ms, 2 s max) au lieu d'un sleep forfaitaire de 1,2 s
+    deadline = time.monotonic() + 2.0
+    while time.monotonic() < deadline:
+        if _tb_process_alive():
+            return
+        time.sleep(0.05)
 
+_ANGLE = re.compile(r"<([^>]+)>")
+
+@functools.lru_cache(maxsize=4096)
 def norm_recipients(raw: str) -> str:
-    if raw is None:
-        return ""
-    s = raw.strip()
-    if not s:
+    # Mémoïsé : les mêmes cellules d'emails parents reviennent souvent
+    # (fratries, classes multiples) — le nettoyage ne se paie qu'une fois.
+    if not raw or not raw.strip():
         return ""
-    s = s.replace(";", ",")
-    s = re.sub(r"\s*,\s*", ",", s)
-    # Nettoyage éventuel de "Nom Prénom <mail>"
+    # Une seule passe : split sur les deux séparateurs puis strip par token,
+    # le re.sub(r"\s*,\s*") global devient inutile.
     parts = []
-    for token in s.split(","):
+    for token in raw.replace(";", ",").split(","):
         token = token.strip()
-        m = re.search(r"<([^>]+)>", token)
+        if not token:
+            continue
+        # Nettoyage éventuel de "Nom Prénom <mail>"
+        m = _ANGLE.search(token)
         parts.append(m.group(1) if m else token)
     return ",".join(parts)
 
+# Table d'échappement précompilée : un seul passage C sur la chaîne
+# au lieu d'un str.replace par caractère à doubler.
+_SQ_TABLE = str.maketrans({"'": "''"})
+
 def escape_compose_value_single_quotes(val: str) -> str:
     if val is None:
         val = ""
-    s = str(val).replace("'", "''")
-    return f"'{s}'"
+    return f"'{str(val).translate(_SQ_TABLE)}'"
 
-def ensure_abs(path: str) -> str:
-    if not path:
-        return ""
-    return os.path.abspath(os.path.expanduser(path))
+# Le corps par défaut est constant : son échappement l'est aussi.
+_DEFAULT_ESCAPED = escape_compose_value_single_quotes(DEFAULT_MESSAGE)
+
+@functools.lru_cache(maxsize=1024)
+def _escape_body(s: str) -> str:
+    # Le corps est très répétitif (message commun à toute l'école) :
+    # un même texte ne s'échappe qu'une fois.
+    return escape_compose_value_single_quotes(s)
 
 def build_compose_arg(to_field: str, subject: str, body: str, attachments_paths):
+    body_esc = _DEFAULT_ESCAPED if body is DEFAULT_MESSAGE else _escape_body(body)
     parts = [
         f"to={escape_compose_value_single_quotes(to_field)}",
         f"subject={escape_compose_value_single_quotes(subject)}",
-        f"body={escape_compose_value_single_quotes(body)}",
+        f"body={body_esc}",
     ]
     att_ok = []
     for p in attachments_paths or []:
         if not p:
             continue
         ap = ensure_abs(p)
-        if os.path.isfile(ap):
+        if attachment_exists(ap):
             att_ok.append(ap)
         else:
             print(f"  [WARN] PJ introuvable : {ap}", file=sys.stderr)
@@ -121,34 +154,43 @@ def build_compose_arg(to_field: str, subject: str, body: str, attachments_paths)
         parts.append(f"attachment={escape_compose_value_single_quotes(','.join(att_ok))}")
     return ",".join(parts)
 
+# Argv réutilisé d'une ligne à l'autre : seuls le binaire (rarement) et la
+# chaîne -compose changent, on mute les cases au lieu de réallouer la liste.
+# Sans danger : Popen copie l'argv avant l'exec.
+_CMD_TEMPLATE: list = [None, "-compose", None]
+
 def open_draft_with_binary(tb_bin, to_field, subject, body, attachments, dry_run=False):
-    compose_str = build_compose_arg(to_field, subject, body, attachments)
-    cmd = [tb_bin, "-compose", compose_str]
+    cmd = _CMD_TEMPLATE
+    cmd[0] = tb_bin
+    cmd[2] = build_compose_arg(to_field, subject, body, attachments)
     if dry_run:
         print("[DRY-RUN] " + " ".join(shlex.quote(c) for c in cmd))
-        return 0
+        return 0, None
     try:
-        # Ne pas bloquer : Popen, sans wait
-        subprocess.Popen(cmd)
-        return 0
+        # Ne pas bloquer : Popen, sans wait.
+        # close_fds=False : aucun FD sensible à protéger ici, et cela permet à
+        # CPython d'emprunter le chemin posix_spawn (pas de fork + parcours de
+        # la table des FD à chaque lancement). Flux détachés vers /dev/null.
+        proc = subprocess.Popen(cmd, close_fds=False,
+                                stdin=subprocess.DEVNULL,
+                                stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL)
+        return 0, proc
     except Exception as e:
         print(f"[ERR] Ouverture compose a échoué : {e}", file=sys.stderr)
-        return 1
-
-def read_csv(path):
-    with open(path, "r", encoding="utf-8-sig", newline="") as f:
-        return list(csv.DictReader(f))
-
-def main():
-    args = parse_args()
-    rows = read_csv(args.csv)
-    total = len(rows)
-    if args.skip:
-        rows = rows[args.skip:]
-    if args.limit is not None:
-        rows = rows[:args.limit]
-
-    print(f"[INFO] Lignes CSV lues : {total} | traitées : {len(rows)} (skip={args.skip}, limit={args.limit})")
+        return 1, None
+
+def main(argv=None):
+    args = parse_args(argv)
+    cols = (args.col_emails, args.col_subject, args.col_body,
+            args.col_att1, args.col_att2)
+    skip = max(0, args.skip or 0)
+    stop = None if args.limit is None else skip + max(0, args.limit)
+    # La fenêtre skip/limit se découpe dans le flux (islice) : on ne
+    # matérialise jamais les lignes hors fenêtre.
+    rows = list(itertools.islice(iter_csv(args.csv, cols), skip, stop))
+
+    print(f"[INFO] Lignes CSV traitées : {len(rows)} (skip={args.skip}, limit={args.limit})")
     print(f"[INFO] Colonnes : Emails='{args.col_emails}', Objet='{args.col_subject}', Message='{args.col_body}', PJ1='{args.col_att1}', PJ2='{args.col_att2}'")
     if args.force_default_body:
         print("[INFO] Message par défaut forcé (--force-default-body).")
@@ -156,36 +198,82 @@ def main():
     tb_bin = find_tb_binary(args.tb_binary)
     ensure_tb_running(dry_run=args.dry_run)
 
+    # Mode --stream : un seul enfant /bin/sh lit les commandes ligne à ligne
+    # sur son stdin et les exécute séquentiellement ; Python ne paie plus un
+    # Popen complet par brouillon. (Thunderbird lui-même reste relancé par
+    # ligne : son protocole -compose n'offre pas de canal persistant.)
+    shell = None
+    if args.stream and not args.dry_run:
+        shell = subprocess.Popen(["/bin/sh", "-s"], stdin=subprocess.PIPE,
+                                 close_fds=False)
+
     sent = 0
     errors = 0
+    # Fenêtre glissante de lancements en cours : avec --max-inflight > 1 on
+    # recouvre le démarrage de Thunderbird au lieu de dormir entre chaque ligne.
+    max_inflight = max(1, args.max_inflight)
+    inflight: collections.deque = collections.deque()
 
-    for i, r in enumerate(rows, 1):
-        raw_to = r.get(args.col_emails, "") or ""
-        to_field = norm_recipients(raw_to)
-        subject = (r.get(args.col_subject, "") or "").strip()
-        csv_body = (r.get(args.col_body, "") or "").strip()
-        body = DEFAULT_MESSAGE if (args.force_default_body or not csv_body) else csv_body
+    # Hoister les lectures d'attributs argparse (LOAD_ATTR sur le Namespace)
+    # hors de la boucle : de simples locals dans le corps chaud.
+    force_default = args.force_default_body
+    default_body = DEFAULT_MESSAGE
+    dry_run = args.dry_run
+    sleep_s = args.sleep
+    n_rows = len(rows)
 
-        att1 = (r.get(args.col_att1, "") or "").strip()
-        att2 = (r.get(args.col_att2, "") or "").strip()
-        attachments = [p for p in [att1, att2] if p]
+    # Cadence par échéance absolue : si le lancement a déjà consommé une
+    # partie de l'intervalle, on ne dort que le résidu au lieu d'ajouter
+    # --sleep entier par-dessus (la dérive ne s'accumule plus).
+    deadline = time.monotonic()
+
+    # Les champs sortent d'iter_csv déjà strip()és : plus aucun nettoyage ici.
+    for i, (raw_to, subject, csv_body, att1, att2) in enumerate(rows, 1):
+        to_field = norm_recipients(raw_to)
+        body = default_body if (force_default or not csv_body) else csv_body
+        attachments = [p for p in (att1, att2) if p]
 
         label = subject if subject else to_field
-        print(f"[{i}/{len(rows)}] → {label}")
+        print(f"[{i}/{n_rows}] → {label}")
 
         if not to_field:
             print("  [WARN] Emails vide → brouillon ignoré.")
             errors += 1
             continue
 
-        rc = open_draft_with_binary(tb_bin, to_field, subject, body, attachments, dry_run=args.dry_run)
+        if shell is not None:
+            compose_str = build_compose_arg(to_field, subject, body, attachments)
+            line = " ".join(shlex.quote(c) for c in (tb_bin, "-compose", compose_str))
+            try:
+                shell.stdin.write((line + "\n").encode())
+                shell.stdin.flush()
+                rc, proc = 0, None
+            except Exception as e:
+                print(f"[ERR] Canal /bin/sh rompu : {e}", file=sys.stderr)
+                rc, proc = 1, None
+        else:
+            rc, proc = open_draft_with_binary(tb_bin, to_field, subject, body, attachments, dry_run=dry_run)
         if rc == 0:
             sent += 1
         else:
             errors += 1
 
-        if args.sleep and not args.dry_run:
-            time.sleep(args.sleep)
+        if proc is not None and max_inflight > 1:
+            inflight.append(proc)
+            if len(inflight) >= max_inflight:
+                inflight.popleft().wait()
+        elif sleep_s and not dry_run:
+            deadline += sleep_s
+            remaining = deadline - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+
+    # Drainer les lancements restants
+    while inflight:
+        inflight.popleft().wait()
+    if shell is not None:
+        shell.stdin.close()
+        shell.wait()
 
     print("\n===== RÉCAP =====")
     print(f"Brouillons ouverts : {sent}")
@@ -22,29 +22,40 @@ Options utiles :
 """
 
 import argparse
-import csv
+import functools
+import itertools
 import os
+import queue
 import shlex
 import subprocess
 import sys
+import threading
 import time
-from pathlib import Path
+import urllib.parse
 
-def read_csv(path):
-    rows = []
-    with open(path, newline="", encoding="utf-8") as f:
-        r = csv.DictReader(f)
-        for row in r:
-            rows.append(row)
-    return rows
+from tb_core import attachment_exists, ensure_abs, iter_csv
+
+# Colonnes lues par main(), dans l'ordre de dépaquetage
+_CSV_COLS = ("Nom", "Prénom", "Prenom", "Classe", "Division", "Emails",
+             "Objet", "CorpsMessage", "Attachments", "PJ_francais", "PJ_math")
 
 def to_file_uri(p):
-    try:
-        return Path(p).expanduser().resolve().as_uri()
-    except Exception:
-        # Dernier recours : préfixer file://
-        q = os.path.abspath(os.path.expanduser(p))
-        return "file://" + q.replace(" ", "%20")
+    # Chemin absolu en pur calcul de chaîne : Path.resolve() ferait un lstat
+    # par composant pour résoudre les symlinks, inutile pour une URI.
+    # quote() encode correctement tous les caractères réservés (#, ?, accents),
+    # pas seulement l'espace.
+    return "file://" + urllib.parse.quote(ensure_abs(p))
+
+# Mémo par chemin brut : URI file:// si la PJ existe, None sinon — la même
+# PJ revient sur plusieurs lignes (documents partagés).
+_ATT_CACHE = {}
+
+def resolve_attachment(p):
+    if p in _ATT_CACHE:
+        return _ATT_CACHE[p]
+    uri = to_file_uri(p) if attachment_exists(ensure_abs(p)) else None
+    _ATT_CACHE[p] = uri
+    return uri
 
 def split_multi(value):
     if not value:
@@ -55,18 +66,30 @@ def split_multi(value):
         parts.extend(chunk.split(","))
     return [x.strip() for x in parts if x.strip()]
 
+# Table d'échappement précompilée : un seul passage C sur la chaîne
+# au lieu d'un str.replace (et d'une allocation intermédiaire) par motif.
+_COMPOSE_TABLE = str.maketrans({"\\": "\\\\", '"': '\\"', "\n": "\\n", "\r": "\\n"})
+
 def escape_compose_value(val):
     """
     Échappe proprement pour le paramètre -compose :
     - entouré de guillemets "
-    - échappe " en \"
+    - échappe " en \" (et double les antislash)
     - remplace les retours ligne par \n (géré par TB)
     """
     if val is None:
         val = ""
-    s = str(val).replace("\\", "\\\\").replace('"', '\\"')
-    s = s.replace("\r\n", "\n").replace("\r", "\n").replace("\n", "\\n")
-    return f"\"{s}\""
+    s = str(val)
+    # Seul \r\n doit être pré-normalisé : la table le transformerait en \n\n
+    if "\r" in s:
+        s = s.replace("\r\n", "\n")
+    return f"\"{s.translate(_COMPOSE_TABLE)}\""
+
+@functools.lru_cache(maxsize=1024)
+def _escape_body(s):
+    # Le corps est très répétitif (message commun à toute l'école) :
+    # un même texte ne s'échappe qu'une fois.
+    return escape_compose_value(s)
 
 def build_compose_cmd(to_addrs, subject, body, attachments):
     # Thunderbird accepte plusieurs champs dans un seul -compose, séparés par des virgules,
@@ -76,7 +99,7 @@ def build_compose_cmd(to_addrs, subject, body, attachments):
     to_field = ",".join(to_addrs)
     parts.append(f"to={escape_compose_value(to_field)}")
     parts.append(f"subject={escape_compose_value(subject)}")
-    parts.append(f"body={escape_compose_value(body)}")
+    parts.append(f"body={_escape_body(body)}")
 
     if attachments:
         # Attachements : liste d’URI file://, séparés par virgules dans UNE valeur
@@ -89,16 +112,37 @@ def build_compose_cmd(to_addrs, subject, body, attachments):
     cmd = ["open", "-a", "Thunderbird", "--args", "-compose", compose_str]
     return cmd
 
+def run_batch_osascript(cmds, throttle):
+    """
+    Regroupe toutes les ouvertures dans un seul script AppleScript exécuté
+    une fois (osascript) : on active Thunderbird une fois puis on enchaîne
+    les -compose avec un petit delay, au lieu de payer un lancement de
+    processus `open` + une pause Python par ligne.
+    """
+    lines = ['tell application "Thunderbird" to activate']
+    for cmd in cmds:
+        sh = " ".join(shlex.quote(c) for c in cmd)
+        esc = sh.replace("\\", "\\\\").replace('"', '\\"')
+        lines.append(f'do shell script "{esc}"')
+        if throttle:
+            lines.append(f"delay {throttle}")
+    script = "\n".join(lines) + "\n"
+    import tempfile
+    fd, path = tempfile.mkstemp(suffix=".applescript", text=True)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(script)
+        return subprocess.run(["osascript", path]).returncode
+    finally:
+        os.unlink(path)
+
 def parse_only_list(path):
     if not path:
         return None
-    keep = set()
+    # frozenset : la table de hachage est figée une fois pour toutes,
+    # le test d'appartenance par ligne ne paie plus que le hash.
     with open(path, encoding="utf-8") as f:
-        for line in f:
-            t = line.strip()
-            if t:
-                keep.add(t)
-    return keep
+        return frozenset(t for t in (line.strip() for line in f) if t)
 
 def main():
     ap = argparse.ArgumentParser(description="Ouvre des rédactions Thunderbird depuis un CSV (macOS).")
@@ -108,36 +152,95 @@ def main():
     ap.add_argument("--start", type=int, default=1, help="Index de départ (1 = première ligne)")
     ap.add_argument("--count", type=int, default=0, help="Nombre de messages à traiter (0 = tout)")
     ap.add_argument("--only-list", help="Fichier texte: une ligne = 'NOM PRENOM' pour restreindre l’envoi")
+    ap.add_argument("--batch", action="store_true",
+                    help="Regrouper toutes les ouvertures dans un seul appel osascript (plus rapide)")
+    ap.add_argument("--parallel", type=int, default=1,
+                    help="Nombre d'ouvertures simultanées (threads) ; --throttle cadence chaque worker")
     args = ap.parse_args()
 
-    rows = read_csv(args.csv)
     only_list = parse_only_list(args.only_list)
 
-    # Fenêtre d’indexation simple
+    # Fenêtre d’indexation simple, découpée dans le flux : les lignes hors
+    # fenêtre ne sont jamais matérialisées
     start_idx = max(1, args.start)
-    end_idx = len(rows) if args.count in (0, None) else min(len(rows), start_idx - 1 + args.count)
+    stop = None if args.count in (0, None) else start_idx - 1 + args.count
+    rows_it = itertools.islice(iter_csv(args.csv, _CSV_COLS), start_idx - 1, stop)
+
+    # Producteur/consommateur : le parsing CSV avance dans un thread pendant
+    # que la boucle principale ouvre les fenêtres (et dort entre deux) —
+    # la lecture se cache derrière le throttle au lieu de s'y ajouter.
+    rows_q: queue.Queue = queue.Queue(maxsize=64)
+
+    # Une erreur du producteur (CSV introuvable, illisible…) est stockée ici
+    # puis relancée côté principal : sans cela le thread mourrait avant
+    # d'enfiler la sentinelle et la boucle bloquerait sur rows_q.get().
+    produce_err = []
+
+    def _produce():
+        try:
+            for t in rows_it:
+                rows_q.put(t)
+        except BaseException as e:
+            produce_err.append(e)
+        finally:
+            rows_q.put(None)  # sentinelle de fin, même en cas d'erreur
+
+    threading.Thread(target=_produce, daemon=True).start()
 
     total, opened, skipped, warned = 0, 0, 0, 0
-    for i, row in enumerate(rows, 1):
-        if i < start_idx or i > end_idx:
-            continue
+    batch_cmds = []  # commandes accumulées en mode --batch
 
+    # --parallel N : les subprocess.run bloquants partent sur N threads,
+    # chacun gardant sa propre cadence --throttle ; le lancement `open`
+    # est essentiellement de l'attente système, les threads suffisent.
+    executor = None
+    futures = []
+    if args.parallel > 1 and not args.dry_run and not args.batch:
+        from concurrent.futures import ThreadPoolExecutor
+        executor = ThreadPoolExecutor(max_workers=args.parallel)
+
+    # Cadence par échéance absolue (et par thread en mode --parallel) : si le
+    # `open` a déjà consommé une partie de l'intervalle, on ne dort que le
+    # résidu au lieu d'ajouter --throttle entier par-dessus.
+    throttle = args.throttle
+    pace = threading.local()
+
+    def _launch(cmd, display_key, to_addrs):
+        d = getattr(pace, "deadline", None)
+        if d is None:
+            d = time.monotonic()
+        try:
+            subprocess.run(cmd, check=True)
+            print(f"[OK] Fenêtre ouverte : {display_key} → {', '.join(to_addrs)}")
+            ok = True
+        except subprocess.CalledProcessError as e:
+            print(f"[ERREUR] {display_key} : {e}", file=sys.stderr)
+            ok = False
+        if throttle:
+            d += throttle
+            remaining = d - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+            pace.deadline = d
+        return ok
+    for (nom, pre1, pre2, cla, divi, emails_raw, objet, corps,
+         attachments, pf, pm) in iter(rows_q.get, None):
         total += 1
 
-        nom = (row.get("Nom","") or "").strip()
-        prenom = (row.get("Prénom","") or row.get("Prenom","") or "").strip()
-        classe = (row.get("Classe","") or row.get("Division","") or "").strip()
+        # Les champs sortent d'iter_csv déjà strip()és.
+        prenom = pre1 or pre2
+        classe = cla or divi
         display_key = f"{classe} | {nom} {prenom}".strip()
 
         if only_list:
-            # Format attendu dans only-list: "NOM PRENOM" (NOM en maj, prénom respecté)
-            key_check = f"{nom.upper()} {prenom}"
-            if key_check not in only_list:
+            # Format attendu dans only-list: "NOM PRENOM" (NOM en maj, prénom respecté).
+            # La clé reste une chaîne : noms et prénoms composés rendent un
+            # découpage en tuple (rsplit) ambigu.
+            if nom.upper() + " " + prenom not in only_list:
                 skipped += 1
                 continue
 
         # Destinataires
-        emails_raw = (row.get("Emails","") or "").strip()
         to_addrs = split_multi(emails_raw)
         if not to_addrs:
             print(f"[SKIP] {display_key} : Emails manquants", file=sys.stderr)
@@ -145,52 +248,68 @@ def main():
             continue
 
         # Objet & Corps
-        subject = (row.get("Objet","") or "Évaluations nationales").strip()
-        body = (row.get("CorpsMessage","") or "Madame, Monsieur,\n\nVeuillez trouver en pièces jointes…").strip()
+        subject = objet or "Évaluations nationales"
+        body = corps or "Madame, Monsieur,\n\nVeuillez trouver en pièces jointes…"
 
-        # Pièces jointes
-        att_paths = []
-        if row.get("Attachments",""):
-            att_paths = [p for p in split_multi(row["Attachments"]) if p]
+        # Pièces jointes (split_multi filtre déjà les éléments vides)
+        if attachments:
+            att_paths = split_multi(attachments)
         else:
-            # Fallback : concat PJ_francais / PJ_math si présents
-            pf = (row.get("PJ_francais","") or "").strip()
-            pm = (row.get("PJ_math","") or "").strip()
-            if pf and pm:
-                att_paths = [pf, pm]
-            elif pf:
-                att_paths = [pf]
-            elif pm:
-                att_paths = [pm]
+            # Fallback : PJ_francais / PJ_math si présentes
+            att_paths = [p for p in (pf, pm) if p]
 
         # Vérification des PJ (on continue quand même si manquantes, mais on prévient)
         att_uris = []
         for p in att_paths:
             if not p:
                 continue
-            if not os.path.exists(os.path.expanduser(p)):
+            uri = resolve_attachment(p)
+            if uri is None:
                 print(f"[AVERTISSEMENT] PJ introuvable pour {display_key} : {p}", file=sys.stderr)
                 warned += 1
                 # On peut choisir de ne pas l’ajouter
                 continue
-            att_uris.append(to_file_uri(p))
+            att_uris.append(uri)
 
         cmd = build_compose_cmd(to_addrs, subject, body, att_uris)
 
         if args.dry_run:
-            print(f"[DRY RUN] {display_key}")
-            print("          TO:", ", ".join(to_addrs))
-            print("          OBJ:", subject)
-            print("          PJ :", ", ".join(att_paths) if att_paths else "(aucune)")
-            print("          CMD:", " ".join(shlex.quote(c) for c in cmd))
+            # Un seul write() par ligne CSV au lieu de 5 print : sur un gros
+            # CSV le dry-run devient borné par le formatage, pas les syscalls
+            sys.stdout.write(
+                f"[DRY RUN] {display_key}\n"
+                f"          TO: {', '.join(to_addrs)}\n"
+                f"          OBJ: {subject}\n"
+                f"          PJ : {', '.join(att_paths) if att_paths else '(aucune)'}\n"
+                f"          CMD: {' '.join(shlex.quote(c) for c in cmd)}\n"
+            )
+        elif args.batch:
+            batch_cmds.append(cmd)
+            print(f"[BATCH] Fenêtre planifiée : {display_key} → {', '.join(to_addrs)}")
+        elif executor is not None:
+            futures.append(executor.submit(_launch, cmd, display_key, to_addrs))
         else:
-            try:
-                subprocess.run(cmd, check=True)
-                print(f"[OK] Fenêtre ouverte : {display_key} → {', '.join(to_addrs)}")
+            if _launch(cmd, display_key, to_addrs):
+                opened += 1
+
+    if executor is not None:
+        for fut in futures:
+            if fut.result():
                 opened += 1
-                time.sleep(args.throttle)
-            except subprocess.CalledProcessError as e:
-                print(f"[ERREUR] {display_key} : {e}", file=sys.stderr)
+        executor.shutdown()
+
+    if produce_err:
+        raise produce_err[0]
+
+    if args.dry_run:
+        sys.stdout.flush()
+
+    if batch_cmds:
+        rc = run_batch_osascript(batch_cmds, args.throttle)
+        if rc == 0:
+            opened = len(batch_cmds)
+        else:
+            print(f"[ERREUR] osascript a renvoyé le code {rc}", file=sys.stderr)
 
     print(f"\nRésumé : total={total}, ouvertes={opened}, ignorées={skipped}, avertissements PJ={warned}")
     if args.dry_run: